@@ -16,11 +16,19 @@ es liefert den Report + einen kompakten Faktentext fuer den Prompt.
 """
 
 from __future__ import annotations
+import hashlib
+import json
+import struct
+import zlib
 from collections import Counter
 from typing import Optional
 
+import numpy as np
+
 from jazzfb import Note, BeatGrid, Changes, analyze, rule_based_summary, from_midi
-from jazzfb.core import from_basic_pitch
+from jazzfb import __version__ as JAZZFB_VERSION
+from jazzfb.core import MidiSource, from_arrays, from_basic_pitch, open_mido
+from jazzfb.report import DEFAULT_TOKEN_BUDGET, estimate_tokens
 from jazzfb.separation import separate
 from jazzfb.analysis import analyze_time_feel, analyze_contour, analyze_voice_leading
 from jazzfb.theory import pc_name
@@ -30,13 +38,13 @@ import standards
 
 # --- Tempo aus MIDI lesen (nur fuer den Default-Vorschlag) ------------------
 
-def tempo_from_midi(path: str) -> Optional[float]:
+def tempo_from_midi(source: MidiSource) -> Optional[float]:
     try:
         import mido
     except ImportError:
         return None
     try:
-        mid = mido.MidiFile(path)
+        mid = open_mido(source)
     except Exception:
         return None
     for track in mid.tracks:
@@ -95,24 +103,28 @@ def _line_no_harmony(line: list[Note]) -> dict:
 
 
 def _line_against_scale(line: list[Note], grid: BeatGrid,
-                        tonic_pc: int, mode: str) -> dict:
+                        tonic_pc: int, mode: str,
+                        key_track: Optional[list[int]] = None) -> dict:
+    """Linie gegen die Tonleiter. Mit key_track (lokale Tonika pro Takt, siehe
+    keymode.local_key_track) wird jede Note gegen IHRE lokale Tonart gewertet."""
     counts = {"chord_tone": 0, "tension": 0, "avoid": 0, "chromatic": 0}
     strong_total = strong_stable = 0
     chromatic_on_strong = []
     for n in line:
-        cls = keymode.classify(n.pc, tonic_pc, mode)
+        bar, beat = grid.position(n.onset)
+        local = key_track[min(max(0, bar), len(key_track) - 1)] if key_track else tonic_pc
+        cls = keymode.classify(n.pc, local, mode)
         counts[cls] += 1
         if grid.is_strong(n.onset):
             strong_total += 1
             if cls == "chord_tone":
                 strong_stable += 1
             elif cls == "chromatic":
-                bar, beat = grid.position(n.onset)
                 chromatic_on_strong.append(
                     dict(bar=bar, beat=round(beat, 2), note=pc_name(n.pc),
-                         chord=keymode.key_label(tonic_pc, mode)))
+                         chord=keymode.key_label(local, mode)))
     total = sum(counts.values()) or 1
-    return {
+    out = {
         "n_notes": sum(counts.values()),
         "distribution": {k: round(v / total, 3) for k, v in counts.items()},
         "counts": counts,
@@ -122,6 +134,9 @@ def _line_against_scale(line: list[Note], grid: BeatGrid,
         # zu Avoid-Noten, hier aber "ausserhalb der Tonleiter".
         "avoid_notes_on_strong_beats": chromatic_on_strong,
     }
+    if key_track:
+        out["key_track"] = keymode.key_segments(key_track, mode)
+    return out
 
 
 def _comp_in_scale_ratio(clusters, tonic_pc: int, mode: str) -> Optional[float]:
@@ -136,19 +151,59 @@ def _comp_in_scale_ratio(clusters, tonic_pc: int, mode: str) -> Optional[float]:
 
 # --- Haupt-Dispatcher -------------------------------------------------------
 
-def _notes_view(sep) -> list[dict]:
-    """Flache Notenliste fuer die Piano-Roll-Darstellung (Transparenz/Pruefung).
-    voice = 'line' (Melodie) oder 'comp' (Begleit-Voicing) — zeigt zugleich,
-    wie die Rollen-Trennung entschieden hat."""
-    out = []
-    for n in sep.line:
-        out.append({"on": round(n.onset, 3), "off": round(n.offset, 3),
-                    "p": n.pitch, "voice": "line"})
-    for c in sep.clusters:
-        for n in c.notes:
-            out.append({"on": round(n.onset, 3), "off": round(n.offset, 3),
-                        "p": n.pitch, "voice": "comp"})
-    return sorted(out, key=lambda x: (x["on"], x["p"]))
+def _notes_view(sep) -> dict:
+    """Notenliste fuer die Piano-Roll-Darstellung (Transparenz/Pruefung),
+    spaltenweise kodiert (siehe encode_notes_view). voice = 'line' (Melodie)
+    oder 'comp' (Begleit-Voicing) — zeigt zugleich, wie die Rollen-Trennung
+    entschieden hat."""
+    rows = [(n.onset, n.offset, n.pitch, False) for n in sep.line]
+    rows += [(n.onset, n.offset, n.pitch, True) for c in sep.clusters for n in c.notes]
+    return encode_notes_view(rows)
+
+
+# --- notes_view: spaltenweise statt ein Dict pro Note -----------------------
+# {"encoding": "columnar-v1", "n": N,
+#  "d_on": Onset-Deltas in ms (erstes Element absolut), "dur": Dauer in ms,
+#  "p": Tonhoehen, "comp": base64(packbits, LSB zuerst), Bit gesetzt = 'comp'}
+# Sortierung wie frueher nach (on, p). ~4x kleiner als die Dict-Liste.
+
+NOTES_VIEW_ENCODING = "columnar-v1"
+
+
+def encode_notes_view(rows) -> dict:
+    """rows: (onset_s, offset_s, pitch, is_comp) -> spaltenweise notes_view."""
+    import base64
+    if not rows:
+        return {"encoding": NOTES_VIEW_ENCODING, "n": 0, "d_on": [], "dur": [], "p": [], "comp": ""}
+    # ms ueber round(x, 3) wie bisher, damit 'full' exakt die alten Werte liefert
+    on = np.array([round(round(r[0], 3) * 1000) for r in rows], dtype=np.int64)
+    off = np.array([round(round(r[1], 3) * 1000) for r in rows], dtype=np.int64)
+    pitch = np.array([r[2] for r in rows], dtype=np.int64)
+    comp = np.array([bool(r[3]) for r in rows])
+    order = np.lexsort((pitch, on))
+    on, off, pitch, comp = on[order], off[order], pitch[order], comp[order]
+    return {"encoding": NOTES_VIEW_ENCODING, "n": int(len(on)),
+            "d_on": np.diff(on, prepend=0).tolist(),
+            "dur": (off - on).tolist(),
+            "p": pitch.tolist(),
+            "comp": base64.b64encode(np.packbits(comp, bitorder="little").tobytes()).decode("ascii")}
+
+
+def notes_view_full(view) -> list[dict]:
+    """Spaltenweise notes_view -> alte Dict-Liste [{on, off, p, voice}, ...]."""
+    import base64
+    if isinstance(view, list):
+        return view
+    n = view.get("n", 0)
+    if not n:
+        return []
+    on = np.cumsum(view["d_on"])
+    off = on + np.asarray(view["dur"])
+    comp = np.unpackbits(np.frombuffer(base64.b64decode(view["comp"]), np.uint8),
+                         count=n, bitorder="little")
+    return [{"on": round(a / 1000, 3), "off": round(b / 1000, 3), "p": p,
+             "voice": "comp" if c else "line"}
+            for a, b, p, c in zip(on.tolist(), off.tolist(), view["p"], comp.tolist())]
 
 
 def analyze_recording(notes: list[Note], grid: BeatGrid, context: dict) -> dict:
@@ -184,7 +239,9 @@ def analyze_recording(notes: list[Note], grid: BeatGrid, context: dict) -> dict:
             if tonic_pc is None:
                 pcs = Counter(n.pc for n in sep.line) or Counter(n.pc for n in notes)
                 tonic_pc = keymode.infer_tonic(pcs, mode)
-            report["line"] = _line_against_scale(sep.line, grid, tonic_pc, mode)
+            track = keymode.local_key_track(notes, grid, mode, tonic_pc=tonic_pc)
+            report["line"] = _line_against_scale(sep.line, grid, tonic_pc, mode,
+                                                 key_track=track)
             report["voicings"]["comp_in_scale_ratio"] = _comp_in_scale_ratio(
                 sep.clusters, tonic_pc, mode)
             report["context"] = {
@@ -206,15 +263,16 @@ def analyze_recording(notes: list[Note], grid: BeatGrid, context: dict) -> dict:
     return report
 
 
-def analyze_midi(midi_path: str, context: dict,
+def analyze_midi(midi: MidiSource, context: dict,
                  beats_per_bar: Optional[int] = None,
                  bpm: Optional[float] = None,
                  downbeat: Optional[float] = None) -> dict:
-    notes = from_midi(midi_path)
+    """midi: Pfad, Bytes oder Datei-Objekt (Upload ohne Temp-Datei)."""
+    notes = from_midi(midi)
     if not notes:
         return {"ok": False, "error": "Keine Noten in der Datei gefunden."}
     if bpm is None:
-        bpm = tempo_from_midi(midi_path) or context.get("tempo_hint") or 120.0
+        bpm = tempo_from_midi(midi) or context.get("tempo_hint") or 120.0
     if downbeat is None:
         downbeat = min(n.onset for n in notes)
     bpb = int(beats_per_bar or context.get("beats_per_bar", 4))
@@ -231,13 +289,97 @@ def analyze_midi(midi_path: str, context: dict,
     }
 
 
+# --- Dedup-Schluessel -------------------------------------------------------
+# Gleiche Eingabe + gleicher aufgeloester Kontext + gleiche Engine -> gleiches
+# Ergebnis. ENGINE_VERSION erhoehen, wenn sich dieses Modul inhaltlich aendert.
+
+ENGINE_VERSION = f"jazzfb-{JAZZFB_VERSION}/service-1"
+
+
+def request_fingerprint(content, context: dict, beats_per_bar: Optional[int],
+                        bpm: Optional[float], llm: bool = True) -> str:
+    """sha256 ueber Engine-Version, Kontext, Takt/Tempo, LLM ja/nein und Eingabe.
+    content: MIDI-Bytes, Datei-Objekt, Note-Event-Liste oder Spalten-Tupel."""
+    h = hashlib.sha256(ENGINE_VERSION.encode("utf-8"))
+    h.update(json.dumps([context, beats_per_bar, bpm, bool(llm)], sort_keys=True,
+                        default=str).encode("utf-8"))
+    if isinstance(content, tuple):
+        for col in content:
+            h.update(np.ascontiguousarray(col).tobytes())
+    elif isinstance(content, (bytes, bytearray, memoryview)):
+        h.update(content)
+    elif hasattr(content, "read"):
+        content.seek(0)
+        for chunk in iter(lambda: content.read(1 << 20), b""):
+            h.update(chunk)
+        content.seek(0)
+    else:
+        h.update(json.dumps(content).encode("utf-8"))
+    return h.hexdigest()
+
+
+# --- Binaeres Note-Event-Format ("JZN1") fuer /analyze-notes ---------------
+# Little-endian: b"JZN1", uint32 n, float32 start[n], float32 end[n],
+# uint8 pitch[n], uint8 amplitude[n] (0..255 ~ 0..1). Optional gzip-komprimiert.
+# 10 Bytes pro Note statt ~40 als JSON-Text; Spalten direkt per frombuffer.
+
+NOTES_MAGIC = b"JZN1"
+NOTES_CONTENT_TYPE = "application/x-jazz-notes"
+
+
+def decode_note_columns(body: bytes, max_notes: int = 2_000_000) -> tuple:
+    """JZN1-Body (roh oder gzip) -> (start, end, pitch, amplitude) als Arrays.
+    ValueError bei falschem Format (auch bei kaputtem gzip)."""
+    if body[:2] == b"\x1f\x8b":
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = d.decompress(body, 8 + 10 * max_notes + 1)    # gzip-Bombe begrenzen
+        except zlib.error as e:
+            raise ValueError(f"JZN1: gzip defekt ({e}).") from e
+    if len(body) < 8 or body[:4] != NOTES_MAGIC:
+        raise ValueError("Kein JZN1-Note-Format.")
+    (n,) = struct.unpack_from("<I", body, 4)
+    if n > max_notes or len(body) != 8 + 10 * n:
+        raise ValueError(f"JZN1: Laenge passt nicht zu n={n}.")
+    start = np.frombuffer(body, "<f4", n, 8)
+    end = np.frombuffer(body, "<f4", n, 8 + 4 * n)
+    pitch = np.frombuffer(body, np.uint8, n, 8 + 8 * n)
+    amplitude = np.frombuffer(body, np.uint8, n, 8 + 9 * n) / 255.0
+    return start, end, pitch, amplitude
+
+
+def encode_note_columns(note_events) -> bytes:
+    """Gegenstueck zu decode_note_columns: [[start, end, pitch, amp], ...] -> JZN1."""
+    ev = np.asarray(note_events, dtype=np.float64).reshape(-1, 4)
+    return b"".join((NOTES_MAGIC, struct.pack("<I", len(ev)),
+                     ev[:, 0].astype("<f4").tobytes(), ev[:, 1].astype("<f4").tobytes(),
+                     np.clip(ev[:, 2], 0, 127).astype(np.uint8).tobytes(),
+                     np.clip(np.rint(ev[:, 3] * 255), 0, 255).astype(np.uint8).tobytes()))
+
+
+def analyze_note_columns(columns: tuple, context: dict,
+                         beats_per_bar: Optional[int] = None,
+                         bpm: Optional[float] = None,
+                         downbeat: Optional[float] = None) -> dict:
+    """Wie analyze_notes, aber aus Spalten (decode_note_columns)."""
+    start, end, pitch, amplitude = columns
+    velocity = np.clip(np.asarray(amplitude) * 127, 1, 127).astype(np.int64)
+    return _analyze_audio_notes(from_arrays(start, end, pitch, velocity), context,
+                                beats_per_bar, bpm, downbeat)
+
+
 def analyze_notes(note_events, context: dict,
                   beats_per_bar: Optional[int] = None,
                   bpm: Optional[float] = None,
                   downbeat: Optional[float] = None) -> dict:
     """Analyse aus rohen Note-Events (z.B. Spotify Basic Pitch im Browser).
     note_events: Liste von [start_s, end_s, pitch_midi, amplitude]."""
-    notes = from_basic_pitch(note_events)
+    return _analyze_audio_notes(from_basic_pitch(note_events), context,
+                                beats_per_bar, bpm, downbeat)
+
+
+def _analyze_audio_notes(notes: list, context: dict, beats_per_bar: Optional[int],
+                         bpm: Optional[float], downbeat: Optional[float]) -> dict:
     if not notes:
         return {"ok": False, "error": "Keine Noten in der Transkription."}
     # Audio liefert kein Tempo -> Vorgabe/Standard. Genaues bpm/downbeat ist hier
@@ -291,6 +433,11 @@ def summarize(report: dict) -> list[str]:
                 f"{round(dist['chord_tone'] * 100)}% stabil, "
                 f"{round(dist['tension'] * 100)}% Tonleiter-Farbtoene, "
                 f"{round(dist['chromatic'] * 100)}% chromatisch (ausserhalb).")
+        segs = line.get("key_track") or []
+        if len(segs) > 1:
+            out.append("Lokale Tonart-Wechsel: " + " → ".join(
+                f"{s['label']} (ab Takt {s['from_bar']})" for s in segs[:5])
+                + (" …" if len(segs) > 5 else "") + ".")
         av = line.get("avoid_notes_on_strong_beats") or []
         if av:
             spots = ", ".join(f"{a['note']} (Takt {a['bar']})" for a in av[:4])
@@ -319,8 +466,12 @@ def summarize(report: dict) -> list[str]:
     return out
 
 
-def facts_for_llm(report: dict, summary: list[str], label: str) -> str:
-    """Kompakter Faktentext fuer den LLM-Prompt — kontextabhaengig."""
+def facts_for_llm(report: dict, summary: list[str], label: str,
+                  token_budget: int = DEFAULT_TOKEN_BUDGET) -> str:
+    """Kompakter Faktentext fuer den LLM-Prompt — kontextabhaengig.
+    Fakten gehen nach Wichtigkeit ins Token-Budget (geteilt mit
+    jazzfb.report.build_feedback_prompt); Zusammenfassungszeilen, die einen
+    Fakt nur wiederholen, entfallen."""
     ctx = report.get("context", {})
     kind = ctx.get("kind", "none")
     line = report.get("line", {})
@@ -363,6 +514,10 @@ def facts_for_llm(report: dict, summary: list[str], label: str) -> str:
         if line.get("chord_tones_on_strong_beats") is not None:
             parts.append("Stabile Toene auf betonten Zeiten: "
                          f"{round(line['chord_tones_on_strong_beats'] * 100)}%.")
+        segs = line.get("key_track") or []
+        if len(segs) > 1:
+            parts.append("Lokale Tonarten (Linie jeweils dagegen gewertet): " + ", ".join(
+                f"{s['label']} T{s['from_bar']}-{s['to_bar']}" for s in segs[:6]) + ".")
         r = report.get("voicings", {}).get("comp_in_scale_ratio")
         if r is not None:
             parts.append(f"Begleit-Voicings: {round(r * 100)}% der Toene in der Tonleiter.")
@@ -385,6 +540,131 @@ def facts_for_llm(report: dict, summary: list[str], label: str) -> str:
         parts.append(f"Ambitus: {cont.get('pitch_range_semitones')} Halbtoene; "
                      f"Dichte: {cont.get('notes_per_second')} Toene/Sek; "
                      f"Dynamik-Range (Velocity): {cont.get('velocity_range')}.")
-    parts.append("Regel-Zusammenfassung:")
-    parts.extend("  - " + s for s in summary)
-    return "\n".join(parts)
+    # Wichtigste Fakten zuerst, bis das Budget erreicht ist
+    out, used = [], 0
+    for p in parts:
+        cost = estimate_tokens(p) + 1
+        if used + cost > token_budget:
+            break
+        out.append(p)
+        used += cost
+    heads = {p.split(":", 1)[0] for p in out}
+    extra = [s for s in summary if s.split(":", 1)[0] not in heads]
+    if extra:
+        used += estimate_tokens("Regel-Zusammenfassung:") + 1
+        bullets = []
+        for s in extra:
+            cost = estimate_tokens(s) + 2
+            if used + cost > token_budget:
+                break
+            bullets.append("  - " + s)
+            used += cost
+        if bullets:
+            out.append("Regel-Zusammenfassung:")
+            out.extend(bullets)
+    return "\n".join(out)
+
+
+# --- Befunde fuer gezielten Wissens-Kontext ---------------------------------
+
+def report_findings(report: dict) -> list[str]:
+    """Konkrete Befunde des Reports als Schluessel (knowledge_loader.FINDING_QUERIES),
+    wichtigste zuerst. Schwellen wie in summarize/rule_based_summary."""
+    ctx = report.get("context", {})
+    kind = ctx.get("kind", "none")
+    line = report.get("line", {})
+    voic = report.get("voicings", {})
+    vl = report.get("voice_leading", {})
+    tf = report.get("time_feel", {})
+    cont = report.get("contour", {})
+    out = []
+
+    if kind in ("changes", "key"):
+        if line.get("avoid_notes_on_strong_beats"):
+            out.append("avoid_on_strong_beats")
+        ct = line.get("chord_tones_on_strong_beats")
+        if ct is not None and ct < 0.40:
+            out.append("weak_chord_tone_anchoring")
+        dist = line.get("distribution") or {}
+        if dist.get("chromatic", 0) >= 0.30:
+            out.append("many_chromatic")
+        elif dist and dist.get("tension", 0) < 0.10:
+            out.append("few_tensions")
+    if kind == "changes" and voic.get("n_voicings"):
+        if voic.get("guide_tone_coverage", 1) < 0.5:
+            out.append("few_guide_tones")
+        if voic.get("rootless_ratio", 1) < 0.3:
+            out.append("rooted_voicings")
+    if kind == "key":
+        r = voic.get("comp_in_scale_ratio")
+        if r is not None and r < 0.7:
+            out.append("comp_outside_scale")
+        if len(line.get("key_track") or []) > 1:
+            out.append("modulation")
+
+    leap = vl.get("top_voice_avg_leap_semitones")
+    if leap is not None and (leap > 3 or vl.get("top_voice_stepwise_ratio", 1) < 0.5):
+        out.append("leapy_top_voice")
+    swing = tf.get("swing_ratio")
+    if swing is not None and swing < 1.15:
+        out.append("straight_feel")
+    bias = tf.get("timing_bias_beats")
+    if bias is not None and bias < -0.02:
+        out.append("rushing")
+    if cont:
+        if (cont.get("pitch_range_semitones") or 0) < 12:
+            out.append("narrow_range")
+        if (cont.get("notes_per_second") or 0) > 6:
+            out.append("dense_line")
+    return out
+
+
+# --- Klassen-Auswertung (Batch) ---------------------------------------------
+
+CLASS_METRICS = {
+    "overall_score": None,                     # Ergebnis-Ebene, nicht Report
+    "chord_tones_on_strong_beats": ("line", "chord_tones_on_strong_beats"),
+    "avoid_notes_on_strong_beats": ("line", "avoid_notes_on_strong_beats"),   # Liste -> Anzahl
+    "stepwise_ratio": ("line", "stepwise_ratio"),
+    "swing_ratio": ("time_feel", "swing_ratio"),
+    "timing_bias_beats": ("time_feel", "timing_bias_beats"),
+    "guide_tone_coverage": ("voicings", "guide_tone_coverage"),
+    "rootless_ratio": ("voicings", "rootless_ratio"),
+    "top_voice_avg_leap_semitones": ("voice_leading", "top_voice_avg_leap_semitones"),
+    "notes_per_second": ("contour", "notes_per_second"),
+}
+
+
+def _distribution(values: dict, bins: int = 5) -> dict:
+    v = np.array(list(values.values()), dtype=np.float64)
+    counts, edges = np.histogram(v, bins=bins)
+    q = np.percentile(v, [25, 50, 75])
+    r = lambda x: round(float(x), 3)
+    return {"n": int(len(v)), "mean": r(v.mean()), "min": r(v.min()), "p25": r(q[0]),
+            "median": r(q[1]), "p75": r(q[2]), "max": r(v.max()),
+            "histogram": {"edges": [r(e) for e in edges], "counts": counts.tolist()},
+            "values": {k: r(x) for k, x in values.items()}}
+
+
+def class_summary(results: list) -> dict:
+    """results: [(name, result), ...] fertiger Analysen desselben Kontexts ->
+    Verteilung der Kernmetriken (CLASS_METRICS) und Haeufigkeit der Befunde."""
+    metrics = {}
+    for key, path in CLASS_METRICS.items():
+        values = {}
+        for name, res in results:
+            val = res.get(key) if path is None else (res.get("report", {}).get(path[0]) or {}).get(path[1])
+            if isinstance(val, list):                # Befundliste: Anzahl wie in der UI
+                val = len(val)
+            if isinstance(val, (int, float)) and not isinstance(val, bool):
+                values[name] = val
+        if values:
+            metrics[key] = _distribution(values)
+    counts = Counter(f for _, res in results for f in res.get("findings", []))
+    n = len(results)
+    return {
+        "n_files": n,
+        "metrics": metrics,
+        "findings": [{"finding": f, "count": c, "share": round(c / n, 3)}
+                     for f, c in counts.most_common()],
+    }
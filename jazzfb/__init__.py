@@ -6,14 +6,16 @@ musikalisch fundierte Analyse raus. Die Transkription (Audio->Noten) liefert
 ein externes Modell (Basic Pitch, Onsets-and-Frames, Piano-to-MIDI-API, MIDI).
 """
 
-from .core import Note, BeatGrid, Changes, ChordSpan, from_midi, from_basic_pitch
+__version__ = "1.0"     # bei Aenderungen am Analyse-Ergebnis erhoehen (Dedup-Schluessel)
+
+from .core import Note, BeatGrid, Changes, ChordSpan, from_midi, from_basic_pitch, from_arrays
 from .theory import parse_chord, Chord
 from .separation import separate, Separated, Cluster
 from .report import (analyze, rule_based_summary, build_feedback_prompt,
                      get_llm_feedback)
 
 __all__ = [
-    "Note", "BeatGrid", "Changes", "ChordSpan", "from_midi", "from_basic_pitch",
+    "Note", "BeatGrid", "Changes", "ChordSpan", "from_midi", "from_basic_pitch", "from_arrays",
     "parse_chord", "Chord", "separate", "Separated", "Cluster",
     "analyze", "rule_based_summary", "build_feedback_prompt", "get_llm_feedback",
 ]
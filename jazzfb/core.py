@@ -6,8 +6,10 @@ Piano-to-MIDI-API, MIDI-Datei) ist egal.
 """
 
 from __future__ import annotations
+import io
+import os
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import Optional, Union
 from .theory import Chord, parse_chord, pitch_to_pc
 
 
@@ -29,11 +31,34 @@ class Note:
         return pitch_to_pc(self.pitch)
 
 
-def from_midi(path: str) -> list[Note]:
-    """Laedt Noten aus einer MIDI-Datei. Versucht pretty_midi, dann mido."""
+MidiSource = Union[str, "os.PathLike", bytes, bytearray, memoryview, io.IOBase]
+
+
+def midi_file_arg(source: MidiSource):
+    """Pfad bleibt Pfad (str); Bytes -> BytesIO; Datei-Objekte werden auf den
+    Anfang gespult, damit mehrere Leser (Noten, Tempo) dieselbe Quelle nutzen."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if hasattr(source, "read"):
+        source.seek(0)
+        return source
+    return os.fspath(source)
+
+
+def open_mido(source: MidiSource):
+    """mido.MidiFile aus Pfad, Bytes oder Datei-Objekt."""
+    import mido
+    src = midi_file_arg(source)
+    return mido.MidiFile(src) if isinstance(src, str) else mido.MidiFile(file=src)
+
+
+def from_midi(source: MidiSource) -> list[Note]:
+    """Laedt Noten aus einer MIDI-Datei (Pfad, Bytes oder Datei-Objekt,
+    z.B. ein Upload ohne Umweg ueber eine Temp-Datei). Versucht pretty_midi,
+    dann mido."""
     try:
         import pretty_midi
-        pm = pretty_midi.PrettyMIDI(path)
+        pm = pretty_midi.PrettyMIDI(midi_file_arg(source))
         notes = []
         for inst in pm.instruments:
             if inst.is_drum:
@@ -50,7 +75,7 @@ def from_midi(path: str) -> list[Note]:
             "Fuer MIDI-Laden bitte 'pip install pretty_midi' (empfohlen) "
             "oder 'pip install mido'."
         ) from e
-    mid = mido.MidiFile(path)
+    mid = open_mido(source)
     notes, on = [], {}
     t = 0.0
     for msg in mido.merge_tracks(mid.tracks):
@@ -64,6 +89,15 @@ def from_midi(path: str) -> list[Note]:
     return sorted(notes, key=lambda x: (x.onset, x.pitch))
 
 
+def from_arrays(start, end, pitch, velocity) -> list[Note]:
+    """Noten aus parallelen Spalten (Listen oder NumPy-Arrays, z.B. direkt aus
+    einem Binaer-Upload). velocity: MIDI-Velocity 1..127."""
+    cols = [c.tolist() if hasattr(c, "tolist") else list(c)
+            for c in (start, end, pitch, velocity)]
+    out = [Note(s, e, int(p), int(v)) for s, e, p, v in zip(*cols)]
+    return sorted(out, key=lambda x: (x.onset, x.pitch))
+
+
 def from_basic_pitch(note_events) -> list[Note]:
     """Adapter fuer Spotify Basic Pitch: dessen note_events sind Tupel
     (start_sec, end_sec, pitch_midi, amplitude, [pitch_bends])."""
@@ -89,20 +89,95 @@ FEEDBACK_SYSTEM = (
 )
 
 
-def build_feedback_prompt(report: dict) -> dict:
-    """Baut die Nachricht fuer einen LLM-Aufruf (z.B. die Anthropic-API)."""
+# Token-Budget fuer die Analyse-Daten im Prompt (geteilt mit
+# jazz_service.facts_for_llm). Grobe Schaetzung ueber Zeichen: exakte
+# Tokenizer sind modellabhaengig, fuer ein Budget reicht die Groessenordnung.
+DEFAULT_TOKEN_BUDGET = 900
+CHARS_PER_TOKEN = 3.5
+
+# Beispiele statt Per-Noten-/Per-Voicing-Listen
+_MAX_AVOID_EXAMPLES = 4
+_MAX_VOICING_EXAMPLES = 3
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _compact_sections(report: dict) -> list[tuple[str, object]]:
+    """Report -> (Schluessel, kompakter Inhalt), wichtigste zuerst.
+    Per-Noten-Arrays (line.detail, notes_view, voicings.voicings, grid)
+    entfallen zugunsten von Aggregaten und wenigen Beispielen."""
+    line = report.get("line", {})
+    voic = report.get("voicings", {})
+    out = []
+    if "context" in report:
+        out.append(("context", report["context"]))
+    out.append(("line", {k: line[k] for k in
+                         ("n_notes", "distribution", "chord_tones_on_strong_beats",
+                          "stepwise_ratio", "avg_interval_semitones")
+                         if line.get(k) is not None}))
+    out.append(("time_feel", report.get("time_feel", {})))
+    out.append(("voice_leading", report.get("voice_leading", {})))
+    out.append(("voicings", {k: v for k, v in voic.items() if k != "voicings"}))
+    out.append(("contour", report.get("contour", {})))
+    av = line.get("avoid_notes_on_strong_beats") or []
+    if av:
+        out.append(("avoid_examples", {"n": len(av), "first": av[:_MAX_AVOID_EXAMPLES]}))
+    if line.get("key_track"):
+        out.append(("key_track", line["key_track"][:6]))
+    # Auffaelligste Voicings (meiste Fremdtoene) als Beispiele
+    vs = sorted(voic.get("voicings") or [], key=lambda v: -len(v.get("outside", ())))
+    ex = [{k: v[k] for k in ("bar", "chord", "chord_tones", "tensions", "outside") if k in v}
+          for v in vs[:_MAX_VOICING_EXAMPLES] if v.get("outside")]
+    if ex:
+        out.append(("voicing_examples", ex))
+    if report.get("changes_view"):
+        out.append(("changes", " ".join(c["symbol"] for c in report["changes_view"])))
+    meta = report.get("meta", {})
+    if meta:
+        out.append(("meta", meta))
+    return [(k, v) for k, v in out if v not in ({}, [], None)]
+
+
+def compact_report(report: dict, token_budget: int = DEFAULT_TOKEN_BUDGET) -> dict:
+    """Kompakte Sicht auf den Report, die (geschaetzt) ins Token-Budget passt.
+    Sektionen werden nach Wichtigkeit aufgenommen, bis das Budget erreicht ist."""
+    out = {}
+    used = 2  # {}
+    for key, value in _compact_sections(report):
+        cost = estimate_tokens(_dumps({key: value}))
+        if used + cost > token_budget:
+            continue
+        out[key] = value
+        used += cost
+    return out
+
+
+def build_feedback_prompt(report: dict, token_budget: int = DEFAULT_TOKEN_BUDGET) -> dict:
+    """Baut die Nachricht fuer einen LLM-Aufruf (z.B. die Anthropic-API).
+    Die Analyse geht kompakt (ohne Per-Noten-Listen) und im Token-Budget mit."""
     user = (
         "Hier die strukturierte Analyse eines Chorus. Formuliere das Feedback "
         "fuer eine Spielerin/einen Spieler.\n\n```json\n"
-        + json.dumps(report, ensure_ascii=False, indent=2) + "\n```"
+        + _dumps(compact_report(report, token_budget)) + "\n```"
     )
     return {"system": FEEDBACK_SYSTEM, "user": user}
 
 
-def get_llm_feedback(report: dict, model: str = "claude-opus-4-8") -> str:
+def get_llm_feedback(report: dict, model: str = "claude-opus-4-8", backend=None) -> str:
     """Optionaler Aufruf der Anthropic-API. Braucht das 'anthropic'-Paket und
-    ANTHROPIC_API_KEY in der Umgebung. Ohne beides wird sauber abgebrochen."""
+    ANTHROPIC_API_KEY in der Umgebung. Ohne beides wird sauber abgebrochen.
+    backend: beliebiges Objekt mit complete(prompt, system=...) (z.B. aus
+    llm_backend.get_backend()) — ersetzt dann den direkten SDK-Aufruf."""
     prompt = build_feedback_prompt(report)
+    if backend is not None:
+        text = backend.complete(prompt["user"], system=prompt["system"], max_tokens=1200)
+        return text if text is not None else "[LLM-Backend lieferte keine Antwort.]"
     try:
         import os, anthropic
         if not os.environ.get("ANTHROPIC_API_KEY"):
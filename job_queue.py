@@ -0,0 +1,176 @@
+"""
+job_queue.py — begrenzte Job-Queue fuer die Analyse-Jobs (Admission Control).
+
+Statt unbegrenzter BackgroundTasks:
+  - feste Anzahl Worker-Threads (JOB_WORKERS); die LLM-Phase laeuft in main
+    auf einer zweiten JobQueue mit LLM_MAX_IN_FLIGHT Workern
+  - begrenzte Tiefe je Prioritaetsklasse: interaktive Uploads
+    (JOB_QUEUE_DEPTH) und Batch-Dateien (JOB_BATCH_DEPTH) getrennt, damit ein
+    Klassen-Batch die Einzel-Uploads nicht aussperrt
+  - interaktive Jobs laufen vor Batch-Jobs (Prioritaet), sonst FIFO
+  - max. JOB_PER_CLIENT wartende+laufende interaktive Jobs pro Client
+Ist kein Platz, wirft submit() QueueFull mit geschaetztem retry_after (fuer
+429 + Retry-After). Noch wartende Jobs nimmt cancel(key) wieder heraus.
+status() liefert Tiefe, Auslastung und Wartezeiten.
+"""
+
+from __future__ import annotations
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+INTERACTIVE = 0
+BATCH = 10
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+
+class QueueFull(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    def __init__(self, workers: int = 4, max_depth: int = 32, max_batch_depth: int = 120,
+                 per_client: int = 4):
+        self.workers = max(1, workers)
+        self.max_depth = {INTERACTIVE: max_depth, BATCH: max_batch_depth}
+        self.per_client = per_client
+        self.cond = threading.Condition()
+        self.heap: list = []
+        self.seq = itertools.count()
+        self.depth = {INTERACTIVE: 0, BATCH: 0}
+        self.running = 0
+        self.clients: dict = {}                # client -> wartende+laufende (interaktiv)
+        self.threads: list = []
+        self.wait_s = deque(maxlen=500)        # letzte Wartezeiten (Sekunden)
+        self.run_s = deque(maxlen=500)
+        self.stats = {"accepted": 0, "rejected_full": 0, "rejected_client": 0,
+                      "completed": 0, "failed": 0, "cancelled": 0}
+
+    @classmethod
+    def from_env(cls) -> "JobQueue":
+        env = os.environ.get
+        return cls(workers=int(env("JOB_WORKERS", "4")),
+                   max_depth=int(env("JOB_QUEUE_DEPTH", "32")),
+                   max_batch_depth=int(env("JOB_BATCH_DEPTH", "120")),
+                   per_client=int(env("JOB_PER_CLIENT", "4")))
+
+    # --- Einreihen ----------------------------------------------------------
+
+    def _retry_after(self) -> int:
+        """Grobe Schaetzung: wartende Jobs x mittlere Laufzeit / Worker."""
+        avg = (sum(self.run_s) / len(self.run_s)) if self.run_s else 2.0
+        queued = self.depth[INTERACTIVE] + self.depth[BATCH]
+        return int(min(120, max(1, math.ceil((queued + 1) * avg / self.workers))))
+
+    def submit(self, fn: Callable, *args, client: Optional[str] = None,
+               priority: int = INTERACTIVE, count: int = 1, key: Optional[str] = None):
+        """Reiht fn(*args) ein. count > 1 prueft vorab Platz fuer so viele Jobs
+        derselben Klasse (Batch: alles oder nichts, dann submit je Datei).
+        key (z.B. analysis_id) macht den Job fuer cancel() auffindbar."""
+        with self.cond:
+            if self.depth[priority] + count > self.max_depth[priority]:
+                self.stats["rejected_full"] += 1
+                raise QueueFull(f"Warteschlange voll ({PRIORITY_NAMES[priority]})",
+                                self._retry_after())
+            if priority == INTERACTIVE and client and self.clients.get(client, 0) >= self.per_client:
+                self.stats["rejected_client"] += 1
+                raise QueueFull(f"Max. {self.per_client} laufende Analysen pro Client",
+                                self._retry_after())
+            if fn is None:                     # reine Platzpruefung
+                return
+            self.depth[priority] += 1
+            if priority == INTERACTIVE and client:
+                self.clients[client] = self.clients.get(client, 0) + 1
+            heapq.heappush(self.heap, (priority, next(self.seq), time.monotonic(),
+                                       client, key, fn, args))
+            self.stats["accepted"] += 1
+            self._ensure_workers()
+            self.cond.notify()
+
+    def check(self, client: Optional[str] = None, priority: int = INTERACTIVE, count: int = 1):
+        """Wie submit, ohne einzureihen (QueueFull, wenn kein Platz)."""
+        self.submit(None, client=client, priority=priority, count=count)
+
+    def cancel(self, key: str) -> Optional[tuple]:
+        """Entfernt den wartenden Job mit diesem key; liefert seine args
+        (zum Aufraeumen) oder None, wenn er schon laeuft bzw. unbekannt ist."""
+        with self.cond:
+            for i, job in enumerate(self.heap):
+                if job[4] == key:
+                    self.heap[i] = self.heap[-1]
+                    self.heap.pop()
+                    heapq.heapify(self.heap)
+                    self.depth[job[0]] -= 1
+                    self._release_client(job[0], job[3])
+                    self.stats["cancelled"] += 1
+                    return job[6]
+        return None
+
+    # --- Worker -------------------------------------------------------------
+
+    def _ensure_workers(self):
+        while len(self.threads) < self.workers:
+            t = threading.Thread(target=self._worker, name=f"job-{len(self.threads)}", daemon=True)
+            self.threads.append(t)
+            t.start()
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.heap:
+                    self.cond.wait()
+                priority, _, queued_at, client, _, fn, args = heapq.heappop(self.heap)
+                self.depth[priority] -= 1
+                self.running += 1
+                self.wait_s.append(time.monotonic() - queued_at)
+            started = time.monotonic()
+            ok = True
+            try:
+                fn(*args)
+            except Exception as e:
+                ok = False
+                print(f"Job error: {e}")
+            finally:
+                with self.cond:
+                    self.running -= 1
+                    self.run_s.append(time.monotonic() - started)
+                    self.stats["completed" if ok else "failed"] += 1
+                    self._release_client(priority, client)
+
+    def _release_client(self, priority: int, client: Optional[str]):
+        if priority == INTERACTIVE and client:
+            left = self.clients.get(client, 1) - 1
+            if left > 0:
+                self.clients[client] = left
+            else:
+                self.clients.pop(client, None)
+
+    # --- Metriken -----------------------------------------------------------
+
+    @staticmethod
+    def _pct(values, q: float) -> Optional[float]:
+        if not values:
+            return None
+        s = sorted(values)
+        return round(s[min(len(s) - 1, int(q * len(s)))], 3)
+
+    def status(self) -> dict:
+        with self.cond:
+            wait, run = list(self.wait_s), list(self.run_s)
+            return {
+                "workers": self.workers, "running": self.running,
+                "queued": {PRIORITY_NAMES[p]: d for p, d in self.depth.items()},
+                "max_depth": {PRIORITY_NAMES[p]: d for p, d in self.max_depth.items()},
+                "per_client": self.per_client, "active_clients": len(self.clients),
+                "wait_p50_s": self._pct(wait, 0.5), "wait_p95_s": self._pct(wait, 0.95),
+                "run_p50_s": self._pct(run, 0.5), "run_p95_s": self._pct(run, 0.95),
+                **self.stats,
+            }
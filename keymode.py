@@ -9,10 +9,15 @@ Erlaubt drei Stufen von Harmonie-Kontext (alle optional):
 Bewusst Tonleiter-basiert (nicht Akkord-basiert): ueber eine ganze Tonart
 sind 2/4/6 diatonische Stufen Farbtoene, KEINE Avoid-Noten — der Akkord-Modell-
 Ansatz (maj7/m7 …) wuerde sie faelschlich als Avoid markieren.
+
+Modulationen: local_key_track() liefert pro Takt die lokale Tonika (gleicher
+Modus), damit Tunes mit wechselndem Zentrum nicht abschnittsweise als
+"chromatisch" gelten.
 """
 
 from __future__ import annotations
 from collections import Counter
+from functools import lru_cache
 from typing import Optional
 
 from jazzfb.theory import NOTE_TO_PC, pc_name
@@ -69,23 +74,125 @@ def classify(pc: int, tonic_pc: int, mode: str) -> str:
     return "chromatic"
 
 
+def _hist12(pcs) -> list[int]:
+    """Counter/Mapping pc->Anzahl -> 12er-Histogramm."""
+    h = [0] * 12
+    for p, w in pcs.items():
+        h[p % 12] += w
+    return h
+
+
+def key_score(hist: list[int], tonic_pc: int, mode: str) -> float:
+    """Passung eines 12er-Histogramms zu Tonika+Modus: Anteil in der Tonleiter,
+    Stabiltoene und Tonika zaehlen extra. Leeres Histogramm -> 0."""
+    total = sum(hist)
+    if not total:
+        return 0.0
+    scale, stable = _key_pcs(mode)[tonic_pc]
+    in_scale = sum(hist[p] for p in scale)
+    on_stable = sum(hist[p] for p in stable)
+    return (in_scale + 0.25 * on_stable + 0.1 * hist[tonic_pc]) / total
+
+
+@lru_cache(maxsize=None)
+def _key_pcs(mode: str) -> tuple:
+    """Pro Tonika (scale_pcs, stable_pcs) als Tupel — Tabellen einmal je Modus."""
+    return tuple((tuple(sorted(scale_pcs(t, mode))), tuple(sorted(stable_pcs(t, mode))))
+                 for t in range(12))
+
+
 def infer_tonic(pcs: Counter, mode: str) -> int:
     """Schaetzt die Tonika bei bekanntem Modus: waehlt die Tonika, deren
     Tonleiter am meisten gespielte Toene abdeckt (Stabiltoene zaehlen extra).
     Robust, weil nur EIN Modus getestet wird — nicht blind Modus+Tonika."""
+    hist = _hist12(pcs)
     best_pc, best_score = 0, -1.0
-    total = sum(pcs.values()) or 1
     for cand in range(12):
-        sc = scale_pcs(cand, mode)
-        st = stable_pcs(cand, mode)
-        in_scale = sum(w for p, w in pcs.items() if p in sc)
-        on_stable = sum(w for p, w in pcs.items() if p in st)
-        on_tonic = pcs.get(cand, 0)
-        score = in_scale / total + 0.25 * (on_stable / total) + 0.1 * (on_tonic / total)
+        score = key_score(hist, cand, mode)
         if score > best_score:
             best_score, best_pc = score, cand
     return best_pc
 
 
+# --- Lokale Tonart (Modulationen) ------------------------------------------
+# Tunes wie Blue Bossa oder So What wechseln das tonale Zentrum; gegen EINE
+# Tonleiter gemessen wuerden ganze Teile als chromatisch gelten. Deshalb pro
+# Takt eine lokale Tonika: Fenster-Histogramme ueber Praefixsummen (jedes
+# Fenster kostet O(12)), dann Viterbi ueber die 12 Tonika-Zustaende mit einer
+# Strafe pro Wechsel (O(12) pro Takt dank "bester Vorgaenger"-Trick).
+# Insgesamt linear in der Taktzahl. Der Modus bleibt fest — transponierte
+# Tonleitern desselben Modus decken auch Dur/Moll-Paare ab (Db-Dur = Bb-Moll).
+
+KEY_WINDOW_BARS = 2         # Fenster = Takt +/- 2 Takte
+KEY_SWITCH_PENALTY = 0.35   # Viterbi-Kosten pro Tonart-Wechsel (Score-Einheiten)
+
+
+def bar_histograms(notes, grid) -> list[list[int]]:
+    """12er-Tonhoehenklassen-Histogramm pro Takt (Takte ab 0, davor -> 0)."""
+    bars = [max(0, grid.position(n.onset)[0]) for n in notes]
+    hists = [[0] * 12 for _ in range((max(bars) + 1) if bars else 0)]
+    for n, b in zip(notes, bars):
+        hists[b][n.pc] += 1
+    return hists
+
+
+def local_key_track(notes, grid, mode: str, tonic_pc: Optional[int] = None,
+                    window: int = KEY_WINDOW_BARS,
+                    penalty: float = KEY_SWITCH_PENALTY) -> list[int]:
+    """Lokale Tonika pro Takt (Liste, Index = Takt). Eine bekannte Tonika
+    verankert den Start; ohne sie entscheidet das erste Fenster."""
+    hists = bar_histograms(notes, grid)
+    n_bars = len(hists)
+    if not n_bars:
+        return []
+    prefix = [[0] * 12]
+    for h in hists:
+        last = prefix[-1]
+        prefix.append([last[p] + h[p] for p in range(12)])
+
+    def emission(b: int) -> list[float]:
+        hi, lo = prefix[min(n_bars, b + window + 1)], prefix[max(0, b - window)]
+        win = [hi[p] - lo[p] for p in range(12)]
+        return [key_score(win, k, mode) for k in range(12)]
+
+    start = emission(0)
+    if tonic_pc is not None:
+        start = [s - (0.0 if k == tonic_pc else penalty) for k, s in enumerate(start)]
+    score, back = start, []
+    for b in range(1, n_bars):
+        best_k = max(range(12), key=score.__getitem__)
+        switch = score[best_k] - penalty
+        e = emission(b)
+        ptr, nxt = [], []
+        for k in range(12):
+            if score[k] >= switch:
+                ptr.append(k)
+                nxt.append(score[k] + e[k])
+            else:
+                ptr.append(best_k)
+                nxt.append(switch + e[k])
+        back.append(ptr)
+        score = nxt
+    k = max(range(12), key=score.__getitem__)
+    track = [k]
+    for ptr in reversed(back):
+        k = ptr[k]
+        track.append(k)
+    return track[::-1]
+
+
+def key_segments(track: list[int], mode: str) -> list[dict]:
+    """Per-Takt-Tonika -> zusammenhaengende Abschnitte (fuer Report/Prompt)."""
+    out, prev = [], None
+    for bar, tonic in enumerate(track):
+        if tonic == prev:
+            out[-1]["to_bar"] = bar
+        else:
+            out.append({"from_bar": bar, "to_bar": bar, "tonic": pc_name(tonic),
+                        "label": key_label(tonic, mode)})
+        prev = tonic
+    return out
+
+
 def key_label(tonic_pc: int, mode: str) -> str:
     return f"{pc_name(tonic_pc)} {MODE_LABELS.get(mode, mode)}"
@@ -1,111 +1,569 @@
 """
 Jazz Knowledge Base Loader - RAG System
-Uses ChromaDB + Sentence Transformers for semantic search
+In-Process BM25-Index (reines Python + NumPy) ueber die ##-Abschnitte der
+Markdown-Dateien in knowledge/. Ersetzt ChromaDB + Sentence Transformers,
+die auf der 512-MB-Instanz nicht mehr hochkamen; der Index baut sich beim
+Start in Millisekunden und beantwortet search() ohne Modell.
+
+Optional semantisch: `python knowledge_loader.py build-embeddings` bettet alle
+Abschnitte und die festen Kontext-Anfragen EINMAL offline ein (braucht
+sentence-transformers nur auf der Build-Maschine) und schreibt float16-Matrizen
++ JSON-Sidecar nach knowledge_embeddings/. Zur Laufzeit werden die Matrizen
+per mmap geladen; eine bekannte Anfrage ist dann ein einziges Skalarprodukt,
+das Modell wird im Server nie geladen. Freie Anfragen laufen ueber BM25.
 """
 
 import os
+import re
+import sys
 import glob
-from typing import List, Dict
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
+import json
+import time
+import hashlib
+import threading
+from collections import Counter
+from typing import List, Dict, Optional, Callable
+
+import numpy as np
+
+
+# ---------------------------------------------------------------------------
+# Tokenisierung (Deutsch + Englisch)
+# ---------------------------------------------------------------------------
+
+_FOLD = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss', '♭': 'b', '♯': '#'})
+_TOKEN_RE = re.compile(r"[a-z0-9#]+")
+
+_STOPWORDS = frozenset("""
+a an and are as at be but by for from has have how if in into is it its of on
+or so that the their then there these this to was were what when where which
+while with you your can will not all also more most very use using used
+der die das den dem des ein eine einer eines einem einen und oder aber mit von
+zu zum zur im in ist sind war auf fuer als auch an bei nach wie wenn dass nicht
+sich es er sie wir ihr man noch nur so vom ueber unter aus um
+""".split())
+
+# Leichte Suffix-Kappung: reicht, um Plural/Flexion zusammenzufuehren
+# ("scales"/"scale", "techniques"/"technique", "akkorde"/"akkord").
+_SUFFIXES = ("ations", "ation", "ings", "ing", "ies", "es", "s", "ed", "ly",
+             "ern", "en", "er", "e")
+_MIN_STEM = 4
+
+
+def _stem(token: str) -> str:
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= _MIN_STEM:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Text -> normalisierte Terme (Umlaute gefaltet, Stoppwoerter raus, gestemmt)."""
+    tokens = _TOKEN_RE.findall(text.lower().translate(_FOLD))
+    return [_stem(t) for t in tokens if t not in _STOPWORDS]
+
+
+# ---------------------------------------------------------------------------
+# BM25
+# ---------------------------------------------------------------------------
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+class BM25Index:
+    """
+    Okapi-BM25 ueber eine feste Dokumentmenge.
+    Die Gewichte werden beim Bau komplett vorberechnet (Term x Dokument), eine
+    Anfrage ist dann nur noch eine Zeilensumme ueber ihre Terme.
+    """
+
+    def __init__(self, counts: List[Dict[str, int]], k1: float = BM25_K1, b: float = BM25_B):
+        """counts: Termhaeufigkeiten je Dokument (siehe from_texts)."""
+        self.vocab: Dict[str, int] = {}
+        for c in counts:
+            for term in c:
+                self.vocab.setdefault(term, len(self.vocab))
+
+        n_docs = len(counts)
+        tf = np.zeros((len(self.vocab), n_docs), dtype=np.float32)
+        for d, c in enumerate(counts):
+            for term, n in c.items():
+                tf[self.vocab[term], d] = n
+
+        doc_len = tf.sum(axis=0)
+        avg_len = float(doc_len.mean()) if n_docs else 0.0
+        df = (tf > 0).sum(axis=1)
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1.0 - b + b * doc_len / avg_len) if avg_len else np.zeros(n_docs)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weights = tf * (k1 + 1.0) / (tf + norm)
+        self.weights = np.nan_to_num(weights) * idf[:, None]
+
+    @classmethod
+    def from_texts(cls, texts: List[str], **kwargs) -> 'BM25Index':
+        return cls([Counter(tokenize(t)) for t in texts], **kwargs)
+
+    def __len__(self) -> int:
+        return self.weights.shape[1]
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25-Score jedes Dokuments fuer die Anfrage."""
+        ids = [self.vocab[t] for t in set(tokenize(query)) if t in self.vocab]
+        if not ids:
+            return np.zeros(len(self), dtype=np.float32)
+        return self.weights[ids].sum(axis=0)
+
+    def top(self, query: str, n: int) -> List[tuple]:
+        """Die n besten (doc_index, score) mit Score > 0, bester zuerst."""
+        scores = self.scores(query)
+        order = np.argsort(-scores, kind='stable')[:n]
+        return [(int(i), float(scores[i])) for i in order if scores[i] > 0]
+
+
+# Suchanfragen fuer get_context_for_analysis (Stil-Kategorie / Rhythmus / immer)
+CONTEXT_QUERIES = {
+    'bebop': "bebop techniques chromatic approach fast tempo",
+    'ballad': "ballad phrasing melodic development space",
+    'modal': "modal scales dorian improvisation",
+    'rhythm_complex': "syncopation rhythmic displacement polyrhythm",
+    'rhythm_simple': "rhythm practice simple patterns",
+    'always': "ii-V-I progression scales",
+}
+
+# Konkrete jazzfb-Befunde (Schluessel aus jazz_service.report_findings) ->
+# Suchanfrage. Die Treffer werden beim Indexieren vorberechnet, ein Befund
+# ist zur Laufzeit ein Dict-Lookup.
+FINDING_QUERIES = {
+    'avoid_on_strong_beats': "guide tones voice leading resolution of 7ths chord tones strong beats",
+    'weak_chord_tone_anchoring': "guide tone lines target chord tones applying guide tones to improvisation",
+    'many_chromatic': "tension and release chromatic approach notes resolve chord tones",
+    'few_tensions': "extended chords 9th 11th 13th tensions vs chord tones",
+    'leapy_top_voice': "voice leading in comping voicing motion common tone movement",
+    'few_guide_tones': "shell voicings guide tones 3rd 7th",
+    'rooted_voicings': "rootless voicings",
+    'comp_outside_scale': "chord-scale relationships voicings comping",
+    'straight_feel': "swing feel eighth notes triplet",
+    'rushing': "playing behind ahead of beat metronome work time",
+    'modulation': "modulation key centers ii-V-I progression turnarounds",
+    'narrow_range': "motivic development phrasing register range",
+    'dense_line': "rest and space phrasing call and response",
+}
+# Abschnitte je Befund (vorberechnet) und Obergrenze im Prompt
+FINDING_SECTIONS = 2
+FINDING_CONTEXT_MAX = 3
+
+# get_context_for_analysis haengt nur an (Stil-Kategorie, Komplexitaets-Bucket):
+# alle Kombinationen werden vorberechnet, ein Job ist dann ein Dict-Lookup.
+CONTEXT_CATEGORIES = ('bebop', 'ballad', 'modal', 'other')
+CONTEXT_BUCKETS = ('simple', 'medium', 'complex')  # <4, 4-7, >7
+# Wie oft (Sekunden) hoechstens geprueft wird, ob sich knowledge/ geaendert hat
+CONTEXT_RECHECK_SECONDS = 30.0
+
+
+def context_key(tempo_category: str, rhythm_complexity: float) -> tuple:
+    """(Kategorie, Bucket) wie in der frueheren Verzweigung von get_context_for_analysis."""
+    cat = tempo_category.lower()
+    if "bebop" in cat or "fast" in cat:
+        category = 'bebop'
+    elif "ballad" in cat or "slow" in cat:
+        category = 'ballad'
+    elif "modal" in cat:
+        category = 'modal'
+    else:
+        category = 'other'
+    if rhythm_complexity > 7:
+        bucket = 'complex'
+    elif rhythm_complexity < 4:
+        bucket = 'simple'
+    else:
+        bucket = 'medium'
+    return category, bucket
+
+
+# ---------------------------------------------------------------------------
+# Inkrementeller Abgleich ueber Datei-Hashes
+# ---------------------------------------------------------------------------
+
+# Persistierter Index-Cache (liegt in knowledge_dir): je Datei Hash, Abschnitte
+# und Termhaeufigkeiten. Nur neue/geaenderte Dateien werden neu zerlegt.
+INDEX_CACHE_NAME = ".index_cache.json"
+_INDEX_CACHE_VERSION = 1
+
+
+def file_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_hashes(files: Optional[Dict[str, Dict]]) -> Dict[str, str]:
+    return {p: f['sha256'] for p, f in (files or {}).items()}
+
+
+def diff_files(current: Dict[str, str], known: Dict[str, str]) -> Dict[str, List[str]]:
+    """Vergleich {Pfad: Hash} jetzt vs. indexiert -> added/changed/removed/unchanged."""
+    return {
+        'added': sorted(p for p in current if p not in known),
+        'changed': sorted(p for p in current if p in known and known[p] != current[p]),
+        'removed': sorted(p for p in known if p not in current),
+        'unchanged': sorted(p for p in current if known.get(p) == current[p]),
+    }
+
+
+def knowledge_files(knowledge_dir: str) -> List[str]:
+    # sortiert: Index-Reihenfolge reproduzierbar
+    return sorted(glob.glob(f"{knowledge_dir}/**/*.md", recursive=True))
+
+
+def read_knowledge_files(knowledge_dir: str) -> Dict[str, bytes]:
+    out = {}
+    for path in knowledge_files(knowledge_dir):
+        try:
+            with open(path, 'rb') as f:
+                out[path] = f.read()
+        except OSError:
+            continue
+    return out
+
+
+def load_index_cache(path: Optional[str]) -> Dict[str, Dict]:
+    """Persistierter Index-Cache: {Pfad: {'sha256', 'sections'}} (leer, wenn fehlt/alt)."""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get('version') != _INDEX_CACHE_VERSION:
+            return {}
+        return cache['files']
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️ Index cache unreadable ({e}) - rebuilding")
+        return {}
+
+
+def format_diff(diff: Dict[str, List[str]]) -> str:
+    lines = [f"{len(diff['unchanged'])} unchanged, {len(diff['added'])} added, "
+             f"{len(diff['changed'])} changed, {len(diff['removed'])} removed"]
+    for kind, mark in (('added', '+'), ('changed', '~'), ('removed', '-')):
+        lines.extend(f"  {mark} {p}" for p in diff[kind])
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------------------
+# Offline gebauter Embedding-Index (float16 .npy + JSON-Sidecar, mmap)
+# ---------------------------------------------------------------------------
+
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+EMBEDDING_DIR = "knowledge_embeddings"
+_SECTIONS_FILE = "sections.f16.npy"
+_QUERIES_FILE = "queries.f16.npy"
+_META_FILE = "index.json"
+
+
+def _section_key(meta: Dict) -> List:
+    return [meta['source'], meta['title'], meta['section_id']]
+
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    m = np.asarray(m, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    return m / np.where(norms == 0, 1.0, norms)
+
+
+def build_embedding_index(knowledge_dir: str = "knowledge",
+                          out_dir: str = EMBEDDING_DIR,
+                          model_name: str = EMBEDDING_MODEL,
+                          encode: Optional[Callable[[List[str]], np.ndarray]] = None) -> Dict:
+    """
+    Offline-Schritt: Abschnitte + feste Anfragen einbetten und ablegen.
+    `encode` (Liste Texte -> Matrix) ersetzt bei Bedarf das Modell.
+    Returns: Inhalt des Sidecars
+    """
+    if encode is None:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name)
+        encode = lambda texts: model.encode(texts, batch_size=32, show_progress_bar=False)
+
+    kb = JazzKnowledgeBase(knowledge_dir, embedding_dir=None)
+    texts = [f"{m['title']}\n{doc}" for m, doc in zip(kb.metadatas, kb.documents)]
+    queries = sorted(set(CONTEXT_QUERIES.values()) | set(FINDING_QUERIES.values()))
+    files = kb.file_hashes()
+
+    # Vorhandene Vektoren unveraenderter Dateien (gleiches Modell) wiederverwenden
+    old_rows, old_queries = {}, {}
+    old = _load_embedding_meta(out_dir)
+    if old and old.get('model') == model_name:
+        old_sections = np.load(os.path.join(out_dir, _SECTIONS_FILE))
+        old_query_vecs = np.load(os.path.join(out_dir, _QUERIES_FILE))
+        old_files = old.get('files', {})
+        for row, key in enumerate(old['sections']):
+            if files.get(key[0]) is not None and old_files.get(key[0]) == files[key[0]]:
+                old_rows[tuple(key)] = old_sections[row]
+        old_queries = {q: old_query_vecs[i] for i, q in enumerate(old['queries'])}
+
+    def _embed(keys, items, cache):
+        todo = [i for i, k in enumerate(keys) if k not in cache]
+        fresh = _normalize(encode([items[i] for i in todo])).astype(np.float16) if todo else None
+        rows = [cache.get(k) for k in keys]
+        for j, i in enumerate(todo):
+            rows[i] = fresh[j]
+        return np.stack(rows) if rows else np.zeros((0, 0), dtype=np.float16), len(todo)
+
+    sections, n_sections = _embed([tuple(_section_key(m)) for m in kb.metadatas], texts, old_rows)
+    query_vecs, n_queries = _embed(queries, queries, old_queries)
+    print(f"   Files: {format_diff(diff_files(files, (old or {}).get('files', {})))}")
+    print(f"   Encoded {n_sections}/{len(texts)} sections, {n_queries}/{len(queries)} queries")
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, _SECTIONS_FILE), sections)
+    np.save(os.path.join(out_dir, _QUERIES_FILE), query_vecs)
+    meta = {
+        'model': model_name,
+        'dim': int(sections.shape[1]),
+        'files': files,
+        'sections': [_section_key(m) for m in kb.metadatas],
+        'queries': queries,
+    }
+    with open(os.path.join(out_dir, _META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+    print(f"✅ Embeddings: {len(texts)} sections, {len(queries)} queries, dim {meta['dim']} -> {out_dir}")
+    return meta
+
+
+def _load_embedding_meta(out_dir: str) -> Optional[Dict]:
+    meta_path = os.path.join(out_dir, _META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class EmbeddingIndex:
+    """
+    Laufzeit-Seite: float16-Matrizen per mmap, Anfragen nur aus der Query-Tabelle.
+    Vektoren sind L2-normiert, der Score ist also die Kosinus-Aehnlichkeit.
+    """
+
+    def __init__(self, sections: np.ndarray, queries: np.ndarray, meta: Dict):
+        self.sections = sections
+        self.query_vecs = queries
+        self.meta = meta
+        self.query_ids = {q: i for i, q in enumerate(meta['queries'])}
+
+    @classmethod
+    def load(cls, out_dir: str, metadatas: List[Dict], files: Dict[str, str]) -> Optional['EmbeddingIndex']:
+        """Laedt den Index; None, wenn er fehlt oder nicht zu den Dateien/Abschnitten passt."""
+        meta = _load_embedding_meta(out_dir)
+        if meta is None:
+            return None
+        if meta.get('files') != files or meta['sections'] != [_section_key(m) for m in metadatas]:
+            print(f"⚠️ Embedding index in {out_dir} is stale - using BM25 only")
+            return None
+        sections = np.load(os.path.join(out_dir, _SECTIONS_FILE), mmap_mode='r')
+        queries = np.load(os.path.join(out_dir, _QUERIES_FILE), mmap_mode='r')
+        return cls(sections, queries, meta)
+
+    def __contains__(self, query: str) -> bool:
+        return query in self.query_ids
+
+    def top(self, query: str, n: int) -> List[tuple]:
+        """Die n aehnlichsten (doc_index, score) fuer eine vorberechnete Anfrage."""
+        q = self.query_vecs[self.query_ids[query]].astype(np.float32)
+        scores = self.sections @ q
+        order = np.argsort(-scores, kind='stable')[:n]
+        return [(int(i), float(scores[i])) for i in order]
+
+
+class _KnowledgeState:
+    """
+    Ein vollstaendig aufgebauter Stand (Abschnitte, Index, Embeddings, Caches).
+    reload() baut einen neuen daneben und tauscht ihn als Ganzes aus; Leser
+    nehmen sich einmal self._state und sehen so nie einen halben Umbau.
+    """
+
+    def __init__(self, fingerprint: tuple = (), files: Optional[Dict[str, Dict]] = None):
+        self.fingerprint = fingerprint
+        # Pfad -> {'sha256', 'sections': [{'title', 'content', 'terms'}]}
+        self.files = files
+        self.documents: List[str] = []
+        self.metadatas: List[Dict] = []
+        self.index = BM25Index([])
+        self.last_diff: Dict[str, List[str]] = {}
+        self.embeddings: Optional[EmbeddingIndex] = None
+        self.context_cache: Dict[tuple, str] = {}
+        self.finding_sections: Dict[str, List[int]] = {}
+        self.timings_ms: Dict[str, float] = {}
+
 
 class JazzKnowledgeBase:
     """
     Retrieval Augmented Generation system for jazz theory knowledge.
-    Loads markdown files from knowledge/ directory and enables semantic search.
+    Loads markdown files from knowledge/ directory and enables BM25 search.
     """
     
-    def __init__(self, knowledge_dir: str = "knowledge", persist_dir: str = ".chromadb"):
+    def __init__(self, knowledge_dir: str = "knowledge", embedding_dir: Optional[str] = EMBEDDING_DIR,
+                 index_cache: Optional[str] = INDEX_CACHE_NAME):
         """
         Initialize the knowledge base.
         
         Args:
             knowledge_dir: Directory containing knowledge markdown files
-            persist_dir: Directory to persist ChromaDB database
+            embedding_dir: Offline gebauter Embedding-Index (None = nur BM25)
+            index_cache: Dateiname des Index-Caches in knowledge_dir (None = nicht persistieren)
         """
         self.knowledge_dir = knowledge_dir
-        self.persist_dir = persist_dir
-        
-        # Initialize embedding model (lightweight, good quality)
-        print("🔄 Loading embedding model...")
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        print("✅ Embedding model loaded")
-        
-        # Initialize ChromaDB
-        print("🔄 Initializing ChromaDB...")
-        self.client = chromadb.PersistentClient(
-            path=persist_dir,
-            settings=Settings(anonymized_telemetry=False)
-        )
-        
-        # Get or create collection
-        self.collection = self.client.get_or_create_collection(
-            name="jazz_knowledge",
-            metadata={"description": "Jazz theory and improvisation knowledge base"}
-        )
+        self.index_cache_path = os.path.join(knowledge_dir, index_cache) if index_cache else None
+        self.embedding_dir = embedding_dir
+        self._state = _KnowledgeState()
+        self._checked_at = 0.0
+        self._reload_lock = threading.Lock()
+        with self._reload_lock:
+            self.reload()
+    
+    # Lesezugriff auf den aktuellen Stand (fuer build_embeddings, CLI, /health)
+    documents = property(lambda self: self._state.documents)
+    metadatas = property(lambda self: self._state.metadatas)
+    index = property(lambda self: self._state.index)
+    embeddings = property(lambda self: self._state.embeddings)
+    last_diff = property(lambda self: self._state.last_diff)
+    timings_ms = property(lambda self: self._state.timings_ms)
+    
+    def _md_files(self) -> List[str]:
+        return knowledge_files(self.knowledge_dir)
+    
+    def _current_fingerprint(self) -> tuple:
+        """(Pfad, mtime, Groesse) aller Wissensdateien - aendert sich mit jedem Edit."""
+        out = []
+        for path in self._md_files():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            out.append((path, st.st_mtime_ns, st.st_size))
+        return tuple(out)
+    
+    def reload(self):
+        """Index, Embeddings und Kontext-Cache als neuen Stand aufbauen und am
+        Ende atomar einsetzen (Aufrufer haelt _reload_lock); Dauer je Phase in
+        timings_ms."""
+        timings = {}
+        t = time.perf_counter()
+        st = _KnowledgeState(self._current_fingerprint(), self._state.files)
+        self._checked_at = time.monotonic()
+        self.load_knowledge(st)
+        timings['index'] = (time.perf_counter() - t) * 1000
         
-        print(f"✅ ChromaDB initialized ({self.collection.count()} documents)")
+        t = time.perf_counter()
+        if self.embedding_dir and st.documents:
+            st.embeddings = EmbeddingIndex.load(self.embedding_dir, st.metadatas, _file_hashes(st.files))
+            if st.embeddings is not None:
+                print(f"✅ Embedding index mapped ({len(st.embeddings.query_ids)} cached queries)")
+        timings['embeddings'] = (time.perf_counter() - t) * 1000
         
-        # Load knowledge if collection is empty
-        if self.collection.count() == 0:
-            print("📚 Knowledge base empty - loading files...")
-            self.load_knowledge()
-        else:
-            print("✅ Using existing knowledge base")
+        t = time.perf_counter()
+        st.context_cache = {
+            (category, bucket): self._build_context(category, bucket, st)
+            for category in CONTEXT_CATEGORIES
+            for bucket in CONTEXT_BUCKETS
+        }
+        # Befund -> Abschnitts-Indizes (Reihenfolge = Relevanz)
+        st.finding_sections = {
+            key: [i for i, _score in self._search_hits(query, FINDING_SECTIONS, st)]
+            for key, query in FINDING_QUERIES.items()
+        }
+        timings['context_cache'] = (time.perf_counter() - t) * 1000
+        st.timings_ms = {k: round(v, 1) for k, v in timings.items()}
+        self._state = st
     
-    def load_knowledge(self):
-        """Load all markdown files from knowledge directory into ChromaDB."""
+    def refresh_if_changed(self, force: bool = False) -> bool:
+        """Baut neu, wenn sich knowledge/ geaendert hat (hoechstens alle
+        CONTEXT_RECHECK_SECONDS geprueft). True = neu aufgebaut."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < CONTEXT_RECHECK_SECONDS:
+            return False
+        with self._reload_lock:
+            self._checked_at = now
+            if self._current_fingerprint() == self._state.fingerprint:
+                return False
+            print("🔄 Knowledge files changed - rebuilding index")
+            self.reload()
+            return True
+    
+    def _save_index_cache(self, files: Dict[str, Dict]):
+        if not self.index_cache_path:
+            return
+        try:
+            tmp = self.index_cache_path + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': _INDEX_CACHE_VERSION, 'files': files}, f, ensure_ascii=False)
+            os.replace(tmp, self.index_cache_path)
+        except OSError as e:
+            print(f"⚠️ Could not write index cache: {e}")
+    
+    def file_hashes(self) -> Dict[str, str]:
+        """{Pfad: sha256} der aktuell indexierten Dateien."""
+        return _file_hashes(self._state.files)
+    
+    def pending_changes(self) -> Dict[str, List[str]]:
+        """Was ein Reindex jetzt aendern wuerde (Platte vs. geladener Stand)."""
+        current = {p: file_hash(data) for p, data in read_knowledge_files(self.knowledge_dir).items()}
+        return diff_files(current, self.file_hashes())
+    
+    def load_knowledge(self, st: _KnowledgeState):
+        """Load markdown files incrementally (per-file hashes) and build the index
+        into st. st.files (vom alten Stand) wird kopiert, nicht veraendert."""
+        files = dict(st.files) if st.files is not None else load_index_cache(self.index_cache_path)
+        st.files = files
+        
         if not os.path.exists(self.knowledge_dir):
             print(f"⚠️ Knowledge directory not found: {self.knowledge_dir}")
             print("   Creating empty knowledge base...")
-            return
         
         # Find all markdown files
-        md_files = glob.glob(f"{self.knowledge_dir}/**/*.md", recursive=True)
+        raw = read_knowledge_files(self.knowledge_dir)
+        current = {p: file_hash(data) for p, data in raw.items()}
+        diff = diff_files(current, _file_hashes(files))
+        st.last_diff = diff
         
-        if not md_files:
-            print(f"⚠️ No markdown files found in {self.knowledge_dir}")
-            return
+        # Nur neue/geaenderte Dateien neu zerlegen, geloeschte entfernen
+        for file_path in diff['added'] + diff['changed']:
+            content = raw[file_path].decode('utf-8')
+            sections = self._split_by_headers(content, file_path)
+            files[file_path] = {
+                'sha256': current[file_path],
+                'sections': [{
+                    'title': sec['title'],
+                    'content': sec['content'],
+                    # Titel mitindexieren: er ist oft das treffendste Stichwort
+                    'terms': dict(Counter(tokenize(f"{sec['title']}\n{sec['content']}"))),
+                } for sec in sections],
+            }
+        for file_path in diff['removed']:
+            del files[file_path]
+        if diff['added'] or diff['changed'] or diff['removed']:
+            self._save_index_cache(files)
         
-        print(f"📖 Found {len(md_files)} markdown files")
+        if not files:
+            print(f"⚠️ No markdown files found in {self.knowledge_dir}")
         
         all_documents = []
         all_metadatas = []
-        all_ids = []
-        
-        for file_path in md_files:
-            print(f"   Loading: {file_path}")
-            
-            # Read file content
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Split by headers (## sections)
-            sections = self._split_by_headers(content, file_path)
-            
-            for section_id, section in enumerate(sections):
-                doc_id = f"{file_path}_{section_id}"
-                
+        all_counts = []
+        for file_path in sorted(files):
+            for section_id, section in enumerate(files[file_path]['sections']):
                 all_documents.append(section['content'])
                 all_metadatas.append({
                     'source': file_path,
                     'title': section['title'],
                     'section_id': section_id
                 })
-                all_ids.append(doc_id)
+                all_counts.append(section['terms'])
         
-        # Add to ChromaDB in batch
-        if all_documents:
-            print(f"💾 Adding {len(all_documents)} sections to ChromaDB...")
-            self.collection.add(
-                documents=all_documents,
-                metadatas=all_metadatas,
-                ids=all_ids
-            )
-            print(f"✅ Knowledge base loaded! ({len(all_documents)} sections)")
-        else:
-            print("⚠️ No content to add")
+        st.documents = all_documents
+        st.metadatas = all_metadatas
+        st.index = BM25Index(all_counts)
+        reindexed = len(diff['added']) + len(diff['changed'])
+        print(f"✅ Knowledge base loaded! ({len(files)} files, {len(all_documents)} sections, "
+              f"{len(st.index.vocab)} terms; {reindexed} re-indexed, {len(diff['removed'])} removed)")
     
     def _split_by_headers(self, content: str, file_path: str) -> List[Dict]:
         """
@@ -153,9 +611,9 @@ class JazzKnowledgeBase:
         
         return sections
     
-    def search(self, query: str, n_results: int = 3) -> List[Dict]:
+    def search(self, query: str, n_results: int = 3, st: Optional[_KnowledgeState] = None) -> List[Dict]:
         """
-        Semantic search in knowledge base.
+        Search in knowledge base (Embeddings fuer bekannte Anfragen, sonst BM25).
         
         Args:
             query: Search query
@@ -164,29 +622,57 @@ class JazzKnowledgeBase:
         Returns:
             List of relevant documents with metadata
         """
-        if self.collection.count() == 0:
+        st = st or self._state
+        if not st.documents:
             print("⚠️ Knowledge base is empty")
             return []
         
-        # Search
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=min(n_results, self.collection.count())
-        )
-        
-        # Format results
+        # Format results ('distance' wie frueher: kleiner = relevanter)
+        semantic = st.embeddings is not None and query in st.embeddings
         formatted_results = []
-        if results and results['documents']:
-            for i in range(len(results['documents'][0])):
-                formatted_results.append({
-                    'content': results['documents'][0][i],
-                    'source': results['metadatas'][0][i].get('source', 'unknown'),
-                    'title': results['metadatas'][0][i].get('title', 'Unknown'),
-                    'distance': results['distances'][0][i] if 'distances' in results else 0.0
-                })
+        for i, score in self._search_hits(query, n_results, st):
+            formatted_results.append(dict(
+                self._section(i, st), score=score,
+                distance=(1.0 - score) if semantic else 1.0 / (1.0 + score)))
         
         return formatted_results
     
+    @staticmethod
+    def _search_hits(query: str, n: int, st: _KnowledgeState) -> List[tuple]:
+        # Vorberechnete Anfrage -> Kosinus ueber die Embeddings, sonst BM25
+        if st.embeddings is not None and query in st.embeddings:
+            return st.embeddings.top(query, n)
+        return st.index.top(query, n)
+    
+    @staticmethod
+    def _section(i: int, st: _KnowledgeState) -> Dict:
+        return {
+            'content': st.documents[i],
+            'source': st.metadatas[i]['source'],
+            'title': st.metadatas[i]['title'],
+        }
+    
+    def get_context_for_findings(self, findings: List[str], max_sections: int = FINDING_CONTEXT_MAX) -> str:
+        """
+        Gezielter Kontext fuer jazzfb-Befunde (Schluessel aus FINDING_QUERIES,
+        wichtigste zuerst). Pro Befund ein Lookup in der vorberechneten Tabelle.
+        
+        Returns:
+            Formatted context string for AI prompt ("" ohne Treffer)
+        """
+        self.refresh_if_changed()
+        st = self._state
+        parts = []
+        seen = set()
+        # Reihum: erst der beste Abschnitt jedes Befunds, dann die zweitbesten
+        for rank in range(FINDING_SECTIONS):
+            for key in findings:
+                ids = st.finding_sections.get(key, [])
+                if rank < len(ids) and ids[rank] not in seen:
+                    seen.add(ids[rank])
+                    parts.append(self._section(ids[rank], st))
+        return self._format_context(parts[:max_sections])
+    
     def get_context_for_analysis(self, 
                                   tempo: float, 
                                   tempo_category: str,
@@ -202,35 +688,30 @@ class JazzKnowledgeBase:
         Returns:
             Formatted context string for AI prompt
         """
+        self.refresh_if_changed()
+        return self._state.context_cache[context_key(tempo_category, rhythm_complexity)]
+    
+    def _build_context(self, category: str, bucket: str, st: _KnowledgeState) -> str:
+        """Formatierter Kontext fuer eine (Kategorie, Bucket)-Kombination."""
         context_parts = []
         
         # Search based on tempo category
-        if "bebop" in tempo_category.lower() or "fast" in tempo_category.lower():
-            results = self.search("bebop techniques chromatic approach fast tempo", n_results=2)
-            context_parts.extend(results)
-        elif "ballad" in tempo_category.lower() or "slow" in tempo_category.lower():
-            results = self.search("ballad phrasing melodic development space", n_results=2)
-            context_parts.extend(results)
-        elif "modal" in tempo_category.lower():
-            results = self.search("modal scales dorian improvisation", n_results=2)
+        if category in ('bebop', 'ballad', 'modal'):
+            results = self.search(CONTEXT_QUERIES[category], n_results=2, st=st)
             context_parts.extend(results)
         
         # Search based on rhythm complexity
-        if rhythm_complexity > 7:
-            results = self.search("syncopation rhythmic displacement polyrhythm", n_results=1)
+        if bucket == 'complex':
+            results = self.search(CONTEXT_QUERIES['rhythm_complex'], n_results=1, st=st)
             context_parts.extend(results)
-        elif rhythm_complexity < 4:
-            results = self.search("rhythm practice simple patterns", n_results=1)
+        elif bucket == 'simple':
+            results = self.search(CONTEXT_QUERIES['rhythm_simple'], n_results=1, st=st)
             context_parts.extend(results)
         
         # Always add some scale/chord info
-        results = self.search("ii-V-I progression scales", n_results=1)
+        results = self.search(CONTEXT_QUERIES['always'], n_results=1, st=st)
         context_parts.extend(results)
         
-        # Format context
-        if not context_parts:
-            return ""
-        
         # Remove duplicates
         seen = set()
         unique_parts = []
@@ -240,9 +721,14 @@ class JazzKnowledgeBase:
                 seen.add(key)
                 unique_parts.append(part)
         
+        return self._format_context(unique_parts[:3])  # Max 3 sections to keep prompt reasonable
+    
+    def _format_context(self, parts: List[Dict]) -> str:
         # Format as text
+        if not parts:
+            return ""
         formatted = "\n\n=== RELEVANT JAZZ THEORY CONTEXT ===\n\n"
-        for part in unique_parts[:3]:  # Max 3 sections to keep prompt reasonable
+        for part in parts:
             formatted += f"## {part['title']}\n"
             formatted += f"(Source: {os.path.basename(part['source'])})\n\n"
             # Limit content length
@@ -254,23 +740,131 @@ class JazzKnowledgeBase:
         return formatted
 
 
-# Global instance (lazy loaded)
+# Global instance (lazy loaded, optional per Hintergrund-Thread vorgewaermt)
 _knowledge_base = None
+_kb_lock = threading.Lock()
+
+# Opt-in: KB_WARMUP=1 baut die Wissensbasis beim Start im Hintergrund
+KB_WARMUP_ENV = "KB_WARMUP"
+
+# cold -> warming -> ready | failed (-> warming: Neuversuch im Hintergrund)
+_kb_status: Dict = {'state': 'cold', 'error': None, 'timings_ms': {}, 'total_ms': None,
+                    'failures': 0, 'retry_in_s': None}
+
+# Neuversuch nach Fehlschlag: 30 s, 60 s, ... hoechstens alle 10 min
+KB_RETRY_BASE_S = 30.0
+KB_RETRY_MAX_S = 600.0
+_kb_retry_thread: Optional[threading.Thread] = None
 
-def get_knowledge_base() -> JazzKnowledgeBase:
+
+def get_knowledge_base(wait: bool = True) -> Optional[JazzKnowledgeBase]:
     """
     Get or create global knowledge base instance.
     Lazy loading to avoid initialization on import.
+    wait=False: waehrend des Warm-ups und nach einem Fehlschlag sofort None
+    statt zu blockieren (der Neuversuch laeuft im Hintergrund).
     """
     global _knowledge_base
-    if _knowledge_base is None:
-        print("🎷 Initializing Jazz Knowledge Base...")
-        _knowledge_base = JazzKnowledgeBase()
+    if _knowledge_base is not None:
+        return _knowledge_base
+    if not wait and _kb_status['state'] in ('warming', 'failed'):
+        return None
+    with _kb_lock:
+        if _knowledge_base is None:
+            _build_knowledge_base()
     return _knowledge_base
 
 
-# Example usage
+def _build_knowledge_base():
+    """Baut die globale Instanz und fuehrt _kb_status mit (Aufrufer haelt _kb_lock)."""
+    global _knowledge_base
+    print("🎷 Initializing Jazz Knowledge Base...")
+    _kb_status.update(state='warming', error=None)
+    t = time.perf_counter()
+    try:
+        kb = JazzKnowledgeBase()
+    except Exception as e:
+        _kb_status.update(state='failed', error=str(e), failures=_kb_status['failures'] + 1)
+        _schedule_retry()
+        raise
+    _kb_status.update(state='ready', retry_in_s=None, timings_ms=dict(kb.timings_ms),
+                      total_ms=round((time.perf_counter() - t) * 1000, 1))
+    _knowledge_base = kb
+    phases = ", ".join(f"{k} {v:.0f} ms" for k, v in kb.timings_ms.items())
+    print(f"✅ Knowledge base ready in {_kb_status['total_ms']:.0f} ms ({phases})")
+
+
+def _schedule_retry():
+    """Genau ein Daemon-Thread baut nach Fehlschlaegen mit wachsendem Abstand neu."""
+    global _kb_retry_thread
+    if _kb_retry_thread is not None and _kb_retry_thread.is_alive():
+        return
+    
+    def _run():
+        delay = KB_RETRY_BASE_S
+        while _knowledge_base is None:
+            _kb_status['retry_in_s'] = delay
+            time.sleep(delay)
+            with _kb_lock:
+                if _knowledge_base is not None:
+                    break
+                try:
+                    _build_knowledge_base()
+                except Exception as e:
+                    print(f"❌ Knowledge base retry failed: {e}")
+            delay = min(delay * 2, KB_RETRY_MAX_S)
+    
+    _kb_retry_thread = threading.Thread(target=_run, name="kb-retry", daemon=True)
+    _kb_retry_thread.start()
+
+
+def knowledge_status() -> Dict:
+    """Bereitschaft der Wissensbasis fuer /health."""
+    return dict(_kb_status)
+
+
+def warmup_enabled() -> bool:
+    return os.environ.get(KB_WARMUP_ENV, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def start_warmup() -> bool:
+    """Startet den Aufbau in einem Daemon-Thread. False, wenn schon (im) Aufbau."""
+    with _kb_lock:
+        if _kb_status['state'] != 'cold':
+            return False
+        _kb_status['state'] = 'warming'
+    
+    def _run():
+        try:
+            get_knowledge_base()
+        except Exception as e:
+            print(f"❌ Knowledge base warm-up failed: {e}")
+    
+    threading.Thread(target=_run, name="kb-warmup", daemon=True).start()
+    return True
+
+
+# Example usage / Build-Schritt
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "build-embeddings":
+        # python knowledge_loader.py build-embeddings [out_dir]
+        build_embedding_index(out_dir=sys.argv[2] if len(sys.argv) > 2 else EMBEDDING_DIR)
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "status":
+        # Was ein Deploy neu indexieren wuerde (Index-Cache und Embeddings)
+        current = {p: file_hash(d) for p, d in read_knowledge_files("knowledge").items()}
+        cached = load_index_cache(os.path.join("knowledge", INDEX_CACHE_NAME))
+        print("Index cache:\n" + format_diff(diff_files(current, {p: f['sha256'] for p, f in cached.items()})))
+        emb = _load_embedding_meta(EMBEDDING_DIR)
+        print("Embeddings:\n" + (format_diff(diff_files(current, emb.get('files', {})))
+                                  if emb else "  not built"))
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "build":
+        # Index-Cache aktualisieren (nur geaenderte Dateien)
+        kb = JazzKnowledgeBase(embedding_dir=None)
+        print(format_diff(kb.last_diff))
+        sys.exit(0)
+    
     # Test the knowledge base
     kb = get_knowledge_base()
     
@@ -0,0 +1,276 @@
+"""
+llm_backend.py — austauschbare LLM-Anbindung fuer das Feedback.
+
+Backends (Auswahl per Umgebungsvariable LLM_BACKEND):
+  - "router":    OpenAI-kompatible Chat-Completions per HTTP (Default: Apertus
+                 ueber den HuggingFace-Router; mit LLM_URL auch gegen den
+                 lokalen mock_llm_server.py)
+  - "anthropic": Anthropic-SDK (Paket 'anthropic' + ANTHROPIC_API_KEY)
+  - "stub":      lokal, deterministisch, ohne Netz (Tests/Benchmarks)
+
+Alle Backends liefern nur den Antworttext (oder None bei Fehlern); Prompt-Bau
+und JSON-Parsing bleiben beim Aufrufer. Mit on_delta wird gestreamt: jedes
+Textstueck geht sofort an den Callback, FeedbackSectionParser meldet daraus
+jede abgeschlossene Kategorie (rhythm/harmony/...), bevor die Antwort fertig ist.
+Wirft der Callback StreamAborted, wird der Stream sofort geschlossen.
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import time
+from typing import Callable, Optional
+
+import requests
+
+
+DEFAULT_ROUTER_URL = "https://router.huggingface.co/v1/chat/completions"
+DEFAULT_ROUTER_MODEL = "swiss-ai/Apertus-8B-Instruct-2509:publicai"
+DEFAULT_ANTHROPIC_MODEL = "claude-opus-4-8"
+
+
+class StreamAborted(Exception):
+    """Aus on_delta geworfen: Antwort wird nicht mehr gebraucht (Job abgebrochen)."""
+
+
+class LLMBackend:
+    """Basis: complete() liefert den Antworttext oder None."""
+    name = "none"
+
+    @property
+    def enabled(self) -> bool:
+        return False
+
+    def complete(self, prompt: str, system: Optional[str] = None,
+                 max_tokens: int = 1400, temperature: float = 0.7,
+                 timeout: float = 90,
+                 on_delta: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """Antworttext oder None; mit on_delta gestreamt (Callback pro Textstueck)."""
+        return None
+
+    def describe(self) -> dict:
+        return {"backend": self.name, "enabled": self.enabled}
+
+
+class RouterBackend(LLMBackend):
+    """OpenAI-kompatibler Chat-Completions-Endpunkt (HF-Router, Mock-Server)."""
+    name = "router"
+
+    def __init__(self, url: str = DEFAULT_ROUTER_URL, model: str = DEFAULT_ROUTER_MODEL,
+                 token: Optional[str] = None):
+        self.url = url
+        self.model = model
+        self.token = token
+        self.session = requests.Session()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token)
+
+    def complete(self, prompt, system=None, max_tokens=1400, temperature=0.7, timeout=90,
+                 on_delta=None):
+        messages = [{"role": "user", "content": prompt}]
+        if system:
+            messages.insert(0, {"role": "system", "content": system})
+        payload = {"model": self.model, "messages": messages,
+                   "max_tokens": max_tokens, "temperature": temperature}
+        if on_delta is not None:
+            payload["stream"] = True
+        response = self.session.post(
+            self.url,
+            headers={"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"},
+            json=payload, timeout=timeout, stream=on_delta is not None,
+        )
+        if response.status_code != 200:
+            print(f"LLM ({self.name}) Error: {response.status_code} - {response.text[:300]}")
+            return None
+        if on_delta is None:
+            return response.json()['choices'][0]['message']['content']
+        return self._read_stream(response, on_delta)
+
+    @staticmethod
+    def _read_stream(response, on_delta) -> str:
+        """Server-Sent Events ('data: {...}' bis 'data: [DONE]') -> Gesamttext."""
+        parts = []
+        with response:
+            for line in response.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                piece = (choices[0].get("delta") or {}).get("content")
+                if piece:
+                    parts.append(piece)
+                    on_delta(piece)
+        return "".join(parts)
+
+    def describe(self) -> dict:
+        return {**super().describe(), "url": self.url, "model": self.model}
+
+
+class AnthropicBackend(LLMBackend):
+    """Anthropic-SDK. Ohne Paket oder API-Key bleibt das Backend inaktiv."""
+    name = "anthropic"
+
+    def __init__(self, model: str = DEFAULT_ANTHROPIC_MODEL):
+        self.model = model
+        self._client = None
+        try:
+            import anthropic
+            if os.environ.get("ANTHROPIC_API_KEY"):
+                self._client = anthropic.Anthropic()
+        except ImportError:
+            pass
+
+    @property
+    def enabled(self) -> bool:
+        return self._client is not None
+
+    def complete(self, prompt, system=None, max_tokens=1400, temperature=0.7, timeout=90,
+                 on_delta=None):
+        if self._client is None:
+            return None
+        kwargs = {"system": system} if system else {}
+        kwargs.update(model=self.model, max_tokens=max_tokens, temperature=temperature,
+                      messages=[{"role": "user", "content": prompt}], timeout=timeout)
+        if on_delta is not None:
+            parts = []
+            with self._client.messages.stream(**kwargs) as stream:
+                for piece in stream.text_stream:
+                    parts.append(piece)
+                    on_delta(piece)
+            return "".join(parts)
+        msg = self._client.messages.create(**kwargs)
+        return "".join(b.text for b in msg.content if b.type == "text")
+
+    def describe(self) -> dict:
+        return {**super().describe(), "model": self.model}
+
+
+def stub_feedback(prompt: str) -> dict:
+    """Deterministisches Feedback im Score-JSON-Format (gleicher Prompt ->
+    gleiche Antwort). Gemeinsam genutzt von StubBackend und mock_llm_server."""
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    out = {}
+    for i, cat in enumerate(("rhythm", "harmony", "melody", "articulation")):
+        score = 5.0 + (digest[i] % 41) / 10          # 5.0 .. 9.0
+        out[cat] = {"score": score,
+                    "feedback": f"[stub] {cat}: automatisch erzeugtes Test-Feedback.",
+                    "tips": [f"[stub] Tipp {k + 1}" for k in range(3)]}
+    return out
+
+
+def stream_chunks(text: str, size: int = 24) -> list:
+    """Text in token-aehnliche Stuecke fuer simuliertes Streaming."""
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+class FeedbackSectionParser:
+    """Inkrementeller Parser fuer das Score-JSON: feed() nimmt beliebige
+    Textstuecke, on_section(kategorie, objekt) feuert, sobald das Objekt einer
+    Top-Level-Kategorie geschlossen ist. Text vor dem ersten '{' (z.B. ```json)
+    wird ignoriert; sections enthaelt alles bisher Erkannte."""
+
+    def __init__(self, on_section: Optional[Callable[[str, dict], None]] = None):
+        self.on_section = on_section
+        self.sections: dict = {}
+        self.buf: list = []        # Text ab dem ersten '{'
+        self.depth = 0
+        self.in_str = False
+        self.esc = False
+        self.key_start = -1        # Beginn eines Top-Level-Schluessels
+        self.key = None
+        self.value_start = -1
+
+    def feed(self, text: str):
+        for ch in text:
+            if self.depth == 0 and ch != "{":
+                continue
+            pos = len(self.buf)
+            self.buf.append(ch)
+            if self.in_str:
+                if self.esc:
+                    self.esc = False
+                elif ch == "\\":
+                    self.esc = True
+                elif ch == '"':
+                    self.in_str = False
+                    if self.depth == 1 and self.key_start >= 0:
+                        raw = "".join(self.buf[self.key_start:pos + 1])
+                        self.key, self.key_start = json.loads(raw), -1
+                continue
+            if ch == '"':
+                self.in_str = True
+                if self.depth == 1:
+                    self.key_start = pos
+            elif ch in "{[":
+                self.depth += 1
+                if self.depth == 2:
+                    self.value_start = pos
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 1 and self.value_start >= 0:
+                    self._emit("".join(self.buf[self.value_start:pos + 1]))
+                    self.value_start = -1
+
+    def _emit(self, raw: str):
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            return
+        if self.key is None or not isinstance(value, dict):
+            return
+        self.sections[self.key] = value
+        if self.on_section is not None:
+            self.on_section(self.key, value)
+
+
+class StubBackend(LLMBackend):
+    """Lokal und deterministisch; optional mit fester Latenz (Sekunden)."""
+    name = "stub"
+
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+
+    @property
+    def enabled(self) -> bool:
+        return True
+
+    def complete(self, prompt, system=None, max_tokens=1400, temperature=0.7, timeout=90,
+                 on_delta=None):
+        text = json.dumps(stub_feedback(prompt), ensure_ascii=False)
+        if on_delta is None:
+            if self.latency_s:
+                time.sleep(self.latency_s)
+            return text
+        chunks = stream_chunks(text)
+        for piece in chunks:                   # Latenz gleichmaessig auf die Stuecke verteilt
+            if self.latency_s:
+                time.sleep(self.latency_s / len(chunks))
+            on_delta(piece)
+        return text
+
+    def describe(self) -> dict:
+        return {**super().describe(), "latency_s": self.latency_s}
+
+
+def get_backend(kind: Optional[str] = None) -> LLMBackend:
+    """Backend aus der Konfiguration (Umgebung):
+    LLM_BACKEND (router|anthropic|stub), LLM_URL, LLM_MODEL, HF_TOKEN bzw.
+    LLM_TOKEN, LLM_STUB_LATENCY."""
+    kind = (kind or os.environ.get("LLM_BACKEND") or "router").strip().lower()
+    model = os.environ.get("LLM_MODEL")
+    if kind == "stub":
+        return StubBackend(float(os.environ.get("LLM_STUB_LATENCY", "0") or 0))
+    if kind == "anthropic":
+        return AnthropicBackend(model or DEFAULT_ANTHROPIC_MODEL)
+    if kind == "router":
+        return RouterBackend(
+            url=os.environ.get("LLM_URL") or DEFAULT_ROUTER_URL,
+            model=model or DEFAULT_ROUTER_MODEL,
+            token=os.environ.get("LLM_TOKEN") or os.environ.get("HF_TOKEN"),
+        )
+    raise ValueError(f"Unbekanntes LLM_BACKEND: {kind!r} (router|anthropic|stub)")
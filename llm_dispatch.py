@@ -0,0 +1,215 @@
+"""
+llm_dispatch.py — zentraler Dispatcher vor dem LLM-Backend.
+
+Begrenzt, wie viel Upstream-Last die Analyse-Jobs erzeugen koennen:
+  - Token-Bucket:   max. Anfragen pro Sekunde (mit Burst)
+  - In-Flight-Cap:  max. gleichzeitige Aufrufe; weitere warten hoechstens
+                    queue_timeout Sekunden, dann Fallback
+  - Circuit-Breaker: nach N Fehlern in Folge "offen" -> sofortiger Fallback
+                    ohne Upstream-Aufruf; nach reset_after Sekunden genau ein
+                    Probe-Aufruf ("half_open"), Erfolg schliesst wieder
+
+complete() liefert wie das Backend den Text oder None; None heisst fuer den
+Aufrufer: regelbasiertes Feedback verwenden. Bricht der Aufrufer einen Stream
+ab (llm_backend.StreamAborted), zaehlt das nicht als Upstream-Fehler.
+status() fuer /health.
+"""
+
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+from llm_backend import StreamAborted
+
+
+class TokenBucket:
+    """rate Tokens/Sekunde, hoechstens burst auf Vorrat. rate <= 0: unbegrenzt."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, timeout: float) -> bool:
+        """Nimmt ein Token; wartet dafuer hoechstens timeout Sekunden."""
+        if self.rate <= 0:
+            return True
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return True
+                wait = (1.0 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """closed -> (failure_threshold Fehler in Folge) -> open -> (reset_after s)
+    -> half_open (ein Probe-Aufruf) -> closed | open."""
+
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_running = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> Tuple[bool, bool]:
+        """(darf aufrufen, ist der Probe-Aufruf). Nur der Probe-Aufruf darf
+        seinen Slot spaeter per record_abort() zurueckgeben."""
+        with self.lock:
+            if self.state == "closed":
+                return True, False
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_after:
+                self.state = "half_open"
+                self.probe_running = False
+            if self.state == "half_open" and not self.probe_running:
+                self.probe_running = True
+                return True, True
+            return False, False
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.probe_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probe_running = False
+
+    def record_abort(self):
+        """Probe-Aufruf ohne Upstream-Ergebnis beendet (Stream-Abbruch, lokale
+        Queue-Zeit abgelaufen): kein Urteil ueber den Upstream, nur den
+        Probe-Slot freigeben. Nur vom Inhaber des Probe-Slots aufrufen."""
+        with self.lock:
+            self.probe_running = False
+
+    def status(self) -> dict:
+        with self.lock:
+            out = {"state": self.state, "consecutive_failures": self.failures}
+            if self.state == "open":
+                out["retry_in_s"] = round(max(0.0, self.reset_after - (time.monotonic() - self.opened_at)), 1)
+            return out
+
+
+class LLMDispatcher:
+    """Rate-Limit + In-Flight-Cap + Circuit-Breaker vor einem llm_backend.LLMBackend."""
+
+    def __init__(self, backend, rate: float = 2.0, burst: int = 4, max_in_flight: int = 4,
+                 queue_timeout: float = 10.0, failure_threshold: int = 5,
+                 reset_after: float = 30.0):
+        self.backend = backend
+        self.bucket = TokenBucket(rate, burst)
+        self.max_in_flight = max_in_flight
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.queue_timeout = queue_timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_after)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.stats = {"calls": 0, "ok": 0, "failed": 0,
+                      "short_circuited": 0, "queue_timeouts": 0, "aborted": 0}
+
+    @classmethod
+    def from_env(cls, backend) -> "LLMDispatcher":
+        """Limits aus der Umgebung (LLM_RATE, LLM_BURST, LLM_MAX_IN_FLIGHT,
+        LLM_QUEUE_TIMEOUT, LLM_BREAKER_FAILURES, LLM_BREAKER_RESET)."""
+        env = os.environ.get
+        return cls(backend,
+                   rate=float(env("LLM_RATE", "2")),
+                   burst=int(env("LLM_BURST", "4")),
+                   max_in_flight=int(env("LLM_MAX_IN_FLIGHT", "4")),
+                   queue_timeout=float(env("LLM_QUEUE_TIMEOUT", "10")),
+                   failure_threshold=int(env("LLM_BREAKER_FAILURES", "5")),
+                   reset_after=float(env("LLM_BREAKER_RESET", "30")))
+
+    def _count(self, key: str, delta: int = 1):
+        with self.lock:
+            self.stats[key] += delta
+
+    def complete(self, prompt: str, **kwargs) -> Optional[str]:
+        """Wie backend.complete(); None sofort, wenn der Breaker offen ist oder
+        innerhalb von queue_timeout kein Slot/Token frei wird."""
+        self._count("calls")
+        allowed, probe = self.breaker.allow()
+        if not allowed:
+            self._count("short_circuited")
+            return None
+
+        deadline = time.monotonic() + self.queue_timeout
+        with self.lock:
+            self.waiting += 1
+        try:
+            got_slot = self.slots.acquire(timeout=self.queue_timeout)
+            if got_slot and not self.bucket.acquire(max(0.0, deadline - time.monotonic())):
+                self.slots.release()
+                got_slot = False
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        if not got_slot:
+            self._count("queue_timeouts")
+            # Lokale Ueberlast sagt nichts ueber den Upstream: Breaker nicht
+            # oeffnen, nur einen selbst gehaltenen Probe-Slot zurueckgeben
+            if probe:
+                self.breaker.record_abort()
+            return None
+        if self.breaker.state == "open":
+            # waehrend des Wartens geoeffnet -> nicht mehr upstream schicken
+            self.slots.release()
+            self._count("short_circuited")
+            return None
+
+        with self.lock:
+            self.in_flight += 1
+        try:
+            text = self.backend.complete(prompt, **kwargs)
+        except StreamAborted:
+            if probe:
+                self.breaker.record_abort()
+            self._count("aborted")
+            return None
+        except Exception as e:
+            print(f"LLM dispatch error: {e}")
+            text = None
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            self.slots.release()
+
+        if text is None:
+            self.breaker.record_failure()
+            self._count("failed")
+        else:
+            self.breaker.record_success()
+            self._count("ok")
+        return text
+
+    def status(self) -> dict:
+        """Queue-Tiefe, In-Flight, Limits, Breaker-Zustand und Zaehler (fuer /health)."""
+        with self.lock:
+            out = {"in_flight": self.in_flight, "queue_depth": self.waiting,
+                   "max_in_flight": self.max_in_flight, "rate_per_s": self.bucket.rate,
+                   **self.stats}
+        out["breaker"] = self.breaker.status()
+        return out
@@ -1,26 +1,45 @@
 # Jazz Improvisation Feedback Platform - MIDI VERSION
 # With Key Selector + Rhythm Detection + Grand Staff Notation
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, Request
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+from starlette.middleware.gzip import GZipMiddleware
 import numpy as np
 import tempfile
 import os
+import gzip
+import io
+import hashlib
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Optional
 import json
-# RAG-Wissensbasis ist optional (schwere Abhaengigkeit: chromadb). Faellt sie
-# aus, laeuft die App trotzdem — nur der alte RAG-Kontext entfaellt.
+# RAG-Wissensbasis (BM25 in-process, nur numpy). Import bleibt defensiv: faellt
+# sie aus, laeuft die App trotzdem — nur der RAG-Kontext entfaellt.
 try:
-    from knowledge_loader import get_knowledge_base
+    from knowledge_loader import get_knowledge_base, knowledge_status, warmup_enabled, start_warmup
 except Exception as _kb_err:
     print(f"⚠️  knowledge_loader nicht verfuegbar ({_kb_err}) — RAG deaktiviert")
-    def get_knowledge_base():
+    _kb_error = str(_kb_err)
+    def get_knowledge_base(wait: bool = True):
         raise RuntimeError("knowledge base unavailable")
+    def knowledge_status():
+        return {"state": "unavailable", "error": _kb_error}
+    def warmup_enabled():
+        return False
+    def start_warmup():
+        return False
 from midi_analyzer import analyze_midi_file, analyze_voice_leading
 import uuid
 from datetime import datetime
-import requests
+import llm_backend
+import llm_dispatch
+import job_queue
+try:
+    import orjson                # schnellere Serialisierung; Fallback: json
+except ImportError:
+    orjson = None
 
 # Neue Engine (jazzfb) + Standards-Bibliothek + Orchestrierung.
 # Loest die alte blinde Harmonie-Erkennung ab: Changes sind bekannt/vorgegeben.
@@ -38,36 +57,98 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Antwort-Kompression ab COMPRESS_MIN_BYTES; brotli, falls brotli_asgi
+# installiert ist (mit gzip-Fallback fuer Clients ohne br), sonst gzip.
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESS_MIN_BYTES, gzip_fallback=True)
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_BYTES, compresslevel=6)
+
+
+def _json_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Nicht serialisierbar: {type(obj).__name__}")
+
+
+def dumps_json(obj) -> bytes:
+    """Kompaktes JSON als Bytes (orjson, sonst json)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"),
+                      default=_json_default).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSON-Response ohne jsonable_encoder; bytes werden unveraendert gesendet
+    (bereits serialisierte, gecachte Ergebnisse)."""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return content if isinstance(content, bytes) else dumps_json(content)
+
 # Apertus AI Configuration - NEW Router API
-HF_TOKEN = os.environ.get("HF_TOKEN")
-APERTUS_URL = "https://router.huggingface.co/v1/chat/completions"
-APERTUS_MODEL = "swiss-ai/Apertus-8B-Instruct-2509:publicai"
+# Backend per LLM_BACKEND waehlbar (router = Apertus via HF-Router, anthropic,
+# stub); siehe llm_backend.py. Default bleibt Apertus mit HF_TOKEN.
+llm = llm_backend.get_backend()
+# Alle LLM-Aufrufe laufen ueber den Dispatcher (Rate-Limit, In-Flight-Cap,
+# Circuit-Breaker); None -> regelbasiertes Feedback. Limits: llm_dispatch.py
+dispatcher = llm_dispatch.LLMDispatcher.from_env(llm)
+# Analyse-Jobs laufen auf einer begrenzten Queue statt auf BackgroundTasks
+# (Tiefe, Limit pro Client, interaktiv vor Batch). Limits: job_queue.py
+jobs = job_queue.JobQueue.from_env()
+# Die LLM-Phase (bis zu Minuten) laeuft auf eigenen Workern, so vielen wie der
+# Dispatcher Slots hat: volle LLM-Slots blockieren keine Noten-Analyse.
+llm_jobs = job_queue.JobQueue(workers=dispatcher.max_in_flight,
+                              max_depth=int(os.environ.get("LLM_JOB_DEPTH", "64")),
+                              max_batch_depth=int(os.environ.get("LLM_BATCH_DEPTH", "240")))
 
 def check_apertus():
-    if HF_TOKEN:
-        print(f"✅ Apertus AI configured (Token: {HF_TOKEN[:10]}...)")
+    if llm.enabled:
+        print(f"✅ LLM configured: {llm.describe()}")
         return True
     else:
-        print("⚠️  HF_TOKEN not found - AI disabled")
+        print(f"⚠️  LLM backend '{llm.name}' not configured (HF_TOKEN?) - AI disabled")
         return False
 
 apertus_enabled = check_apertus()
 
 analysis_results = {}
 
+@app.on_event("startup")
+async def warm_up_knowledge_base():
+    # Opt-in (KB_WARMUP=1): Index im Hintergrund bauen, Start blockiert nicht
+    if warmup_enabled() and start_warmup():
+        print("🔥 Knowledge base warm-up started in background")
+
 # ============================================================================
 # WEB UI WITH KEY SELECTOR + RHYTHM
 # ============================================================================
 
 from ui_template import HTML_TEMPLATE  # eingebettete Web-UI (ausgelagert)
 
+# Template einmal kodieren/komprimieren; ETag + no-cache -> Reload = 304
+_TEMPLATE_BYTES = HTML_TEMPLATE.encode("utf-8")
+_TEMPLATE_GZIP = gzip.compress(_TEMPLATE_BYTES, 9)
+_TEMPLATE_ETAG = '"' + hashlib.sha256(_TEMPLATE_BYTES).hexdigest()[:16] + '"'
+
 @app.get("/", response_class=HTMLResponse)
-async def root():
-    return HTML_TEMPLATE
+async def root(request: Request):
+    headers = {"ETag": _TEMPLATE_ETAG, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _TEMPLATE_ETAG in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(_TEMPLATE_GZIP, media_type="text/html",
+                        headers={**headers, "Content-Encoding": "gzip"})
+    return HTMLResponse(_TEMPLATE_BYTES, headers=headers)
 
 @app.get("/ai-status")
 async def ai_status():
-    return {"ai_enabled": apertus_enabled}
+    return {"ai_enabled": apertus_enabled, "llm": llm.describe()}
 
 # ============================================================================
 # JAZZ PATTERN ANALYSIS
@@ -100,13 +181,14 @@ def analyze_jazz_patterns(audio_features: Dict) -> Dict:
 # ============================================================================
 
 async def get_apertus_feedback(audio_features: Dict, jazz_analysis: Dict, note_analysis: Dict, user_key: str) -> Dict:
-    if not apertus_enabled or not HF_TOKEN:
+    if not apertus_enabled:
         return None
     
     try:
         try:
-            kb = get_knowledge_base()
-            jazz_context = kb.get_context_for_analysis(tempo=audio_features.get('tempo', 120), tempo_category=jazz_analysis['tempo_category'], rhythm_complexity=5)
+            # Waehrend des Warm-ups ohne RAG-Kontext weiter statt zu warten
+            kb = get_knowledge_base(wait=False)
+            jazz_context = "" if kb is None else kb.get_context_for_analysis(tempo=audio_features.get('tempo', 120), tempo_category=jazz_analysis['tempo_category'], rhythm_complexity=5)
         except: jazz_context = ""
         
         chord_info = ""
@@ -133,28 +215,10 @@ Gib Feedback (1-10) für: Rhythmus, Harmonie, Melodie, Artikulation.
 Antworte NUR als JSON:
 {{"rhythm": {{"score": 7.5, "feedback": "...", "tips": ["...", "...", "..."]}}, "harmony": {{"score": 8.0, "feedback": "...", "tips": ["...", "...", "..."]}}, "melody": {{"score": 6.5, "feedback": "...", "tips": ["...", "...", "..."]}}, "articulation": {{"score": 7.0, "feedback": "...", "tips": ["...", "...", "..."]}}}}"""
         
-        # NEW: Use Router API with requests
-        response = requests.post(
-            APERTUS_URL,
-            headers={
-                "Authorization": f"Bearer {HF_TOKEN}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": APERTUS_MODEL,
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 1200,
-                "temperature": 0.7
-            },
-            timeout=60
-        )
-        
-        if response.status_code != 200:
-            print(f"Apertus API Error: {response.status_code} - {response.text}")
+        text = dispatcher.complete(prompt, max_tokens=1200, temperature=0.7, timeout=60)
+        if text is None:
             return None
         
-        result = response.json()
-        text = result['choices'][0]['message']['content']
         text = text.replace('```json', '').replace('```', '').strip()
         if "{" in text: text = text[text.find("{"):text.rfind("}")+1]
         return json.loads(text)
@@ -176,12 +240,12 @@ def generate_rule_based_feedback(audio_features: Dict, jazz_analysis: Dict) -> D
 # BACKGROUND PROCESSING
 # ============================================================================
 
-def process_midi_in_background(analysis_id: str, tmp_path: str, user_key: str):
+def process_midi_in_background(analysis_id: str, midi, user_key: str):
     import asyncio, gc
     try:
-        analysis_results[analysis_id] = {"status": "processing", "stage": "notes"}
+        _write_entry(analysis_id, {"status": "processing", "stage": "notes"})
         
-        note_analysis = analyze_midi_file(tmp_path)
+        note_analysis = analyze_midi_file(midi)
         note_analysis['detected_scale'] = user_key
         
         if note_analysis.get('error') or note_analysis.get('total_notes', 0) == 0:
@@ -202,8 +266,9 @@ def process_midi_in_background(analysis_id: str, tmp_path: str, user_key: str):
         
         jazz_analysis = analyze_jazz_patterns(audio_features)
         gc.collect()
-        
-        analysis_results[analysis_id] = {"status": "processing", "stage": "ai"}
+        if not _write_entry(analysis_id, {"status": "processing", "stage": "ai"}):
+            return
+
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         feedback = loop.run_until_complete(get_apertus_feedback(audio_features, jazz_analysis, note_analysis, user_key))
@@ -213,7 +278,7 @@ def process_midi_in_background(analysis_id: str, tmp_path: str, user_key: str):
         
         overall_score = (feedback["rhythm"]["score"] + feedback["harmony"]["score"] + feedback["melody"]["score"] + feedback["articulation"]["score"]) / 4
         
-        analysis_results[analysis_id] = {"status": "completed", "result": {
+        _write_entry(analysis_id, {"status": "completed", "result": {
             "overall_score": round(overall_score, 1),
             "audio_features": audio_features,
             "jazz_analysis": jazz_analysis,
@@ -221,25 +286,39 @@ def process_midi_in_background(analysis_id: str, tmp_path: str, user_key: str):
             "feedback": feedback,
             "ai_generated": apertus_enabled,
             "user_key": user_key
-        }}
+        }})
     except Exception as e:
         import traceback; traceback.print_exc()
-        analysis_results[analysis_id] = {"status": "error", "error": str(e)}
+        _write_entry(analysis_id, {"status": "error", "error": str(e)})
     finally:
-        if os.path.exists(tmp_path): os.unlink(tmp_path)
+        _close_upload(midi)
 
 # ============================================================================
 # NEUE ENGINE: jazzfb gegen BEKANNTE Changes (Slice 1)
 # ============================================================================
 
-async def get_apertus_feedback_grounded(facts: str, context_label: str) -> Optional[Dict]:
+FEEDBACK_CATEGORIES = ("rhythm", "harmony", "melody", "articulation")
+
+
+async def get_apertus_feedback_grounded(facts: str, context_label: str,
+                                        knowledge_context: str = "",
+                                        on_section=None, should_abort=None) -> Optional[Dict]:
     """Apertus-Feedback, das auf den regelbasierten jazzfb-Fakten fusst.
     Behaelt das bestehende Score-JSON-Format (rhythm/harmony/melody/
     articulation), damit die UI unveraendert rendert. Die Fakten enthalten
     bereits den Harmonie-Kontext (volle Changes / Tonart / keiner) — der
-    Prompt ist deshalb kontext-neutral gehalten."""
-    if not apertus_enabled or not HF_TOKEN:
+    Prompt ist deshalb kontext-neutral gehalten.
+    Mit on_section(kategorie, objekt) wird gestreamt: jede Kategorie geht
+    raus, sobald ihr JSON-Objekt komplett ist. should_abort() wird vor jedem
+    Textstueck gefragt; True bricht den Stream ab (-> None)."""
+    if not apertus_enabled:
         return None
+    parser = llm_backend.FeedbackSectionParser(on_section) if on_section else None
+
+    def on_delta(piece):
+        if should_abort and should_abort():
+            raise llm_backend.StreamAborted()
+        parser.feed(piece)
     try:
         prompt = f"""Du bist ein erfahrener Jazz-Pianist und Klavier-Lehrer. Unten steht eine
 AUTOMATISCH ERZEUGTE, REGELBASIERTE Analyse eines Solo-Klavier-Stuecks ({context_label}).
@@ -252,7 +331,7 @@ nicht einzelne Noten.
 
 ANALYSE-FAKTEN:
 {facts}
-
+{knowledge_context}
 Gib didaktisches, ermutigendes, musikalisch fundiertes Feedback. Bewerte (1.0-10.0)
 und begruende kurz fuer: Rhythmus/Time-Feel, Harmonie (so weit der Kontext es
 hergibt), Melodie/Linienfuehrung, Artikulation/Dynamik. Jede Kategorie mit
@@ -260,18 +339,12 @@ hergibt), Melodie/Linienfuehrung, Artikulation/Dynamik. Jede Kategorie mit
 Antworte NUR als JSON:
 {{"rhythm": {{"score": 7.5, "feedback": "...", "tips": ["...","...","..."]}}, "harmony": {{"score": 8.0, "feedback": "...", "tips": ["...","...","..."]}}, "melody": {{"score": 6.5, "feedback": "...", "tips": ["...","...","..."]}}, "articulation": {{"score": 7.0, "feedback": "...", "tips": ["...","...","..."]}}}}"""
 
-        response = requests.post(
-            APERTUS_URL,
-            headers={"Authorization": f"Bearer {HF_TOKEN}", "Content-Type": "application/json"},
-            json={"model": APERTUS_MODEL,
-                  "messages": [{"role": "user", "content": prompt}],
-                  "max_tokens": 1400, "temperature": 0.7},
-            timeout=90,
-        )
-        if response.status_code != 200:
-            print(f"Apertus API Error: {response.status_code} - {response.text}")
+        text = dispatcher.complete(prompt, max_tokens=1400, temperature=0.7, timeout=90,
+                                   on_delta=on_delta if parser else None)
+        if text is None:
             return None
-        text = response.json()['choices'][0]['message']['content']
+        if parser and all(c in parser.sections for c in FEEDBACK_CATEGORIES):
+            return {c: parser.sections[c] for c in FEEDBACK_CATEGORIES}
         text = text.replace('```json', '').replace('```', '').strip()
         if "{" in text:
             text = text[text.find("{"):text.rfind("}") + 1]
@@ -282,81 +355,422 @@ Antworte NUR als JSON:
         return None
 
 
-def _finish_jazz_analysis(analysis_id: str, res: dict):
-    """Gemeinsamer Abschluss fuer MIDI- und Audio/Note-Events-Pfad:
-    Fakten -> Apertus -> Score -> Ergebnis ablegen."""
-    import asyncio
-    if not res.get("ok"):
-        analysis_results[analysis_id] = {"status": "error",
-                                         "error": res.get("error", "Analyse fehlgeschlagen.")}
+def _knowledge_context_for(findings: list) -> str:
+    """Vorberechneter Wissens-Kontext zu den Befunden ("" ohne RAG/waehrend Warm-up)."""
+    if not findings:
+        return ""
+    try:
+        kb = get_knowledge_base(wait=False)
+        return "" if kb is None else kb.get_context_for_findings(findings)
+    except Exception:
+        return ""
+
+
+# --- Abbruch (DELETE /result/{id}) -----------------------------------------
+# Wartende Jobs nimmt jobs.cancel() heraus; laufende bekommen ein Flag und
+# pruefen es an den Checkpoints (nach den Noten, vor/waehrend des LLM-Aufrufs).
+# Jobs schreiben nur ueber _write_entry, unter demselben Lock, mit dem DELETE
+# Flag setzt und Eintrag entfernt: ein abgebrochener Job legt nichts mehr ab.
+# _running zaehlt die laufenden Phasen eines Jobs (Analyse, LLM auf llm_jobs);
+# das Flag verschwindet erst mit der letzten.
+_results_lock = threading.Lock()
+_running: Dict[str, int] = {}
+_job_ctx = threading.local()                   # Prioritaet des laufenden Queue-Jobs
+_cancelled: set = set()
+
+
+def _cancel_requested(analysis_id: str) -> bool:
+    return analysis_id in _cancelled
+
+
+def _write_entry(analysis_id: str, entry: dict) -> bool:
+    """Eintrag eines Jobs setzen; False (nichts geschrieben) nach Abbruch."""
+    with _results_lock:
+        if analysis_id in _cancelled:
+            return False
+        analysis_results[analysis_id] = entry
+        return True
+
+
+def _phase_started(analysis_id: str):
+    with _results_lock:
+        _running[analysis_id] = _running.get(analysis_id, 0) + 1
+
+
+def _phase_done(analysis_id: str):
+    with _results_lock:
+        left = _running.get(analysis_id, 1) - 1
+        if left > 0:
+            _running[analysis_id] = left
+        else:
+            _running.pop(analysis_id, None)
+            _cancelled.discard(analysis_id)
+
+
+def _run_job(fn, analysis_id: str, priority: int, *args):
+    """Rahmen fuer jeden Queue-Job: vor dem Start geloeschte Jobs laufen gar
+    nicht erst; das Abbruch-Flag verschwindet mit dem Job-Ende (bzw. dem
+    Ende der LLM-Phase, falls der Job eine an llm_jobs uebergeben hat)."""
+    with _results_lock:
+        started = analysis_id in analysis_results
+        if started:
+            _running[analysis_id] = _running.get(analysis_id, 0) + 1
+    if not started:
+        for arg in args:
+            _close_upload(arg)
         return
-    report, summary, used = res["report"], res["summary"], res["used"]
+    _job_ctx.priority = priority
+    try:
+        fn(analysis_id, *args)
+    finally:
+        _phase_done(analysis_id)
+
+
+def _cancel_entry(analysis_id: str) -> Optional[dict]:
+    """Eintrag entfernen (None, wenn unbekannt); ein laufender Job bekommt
+    im selben Schritt das Abbruch-Flag."""
+    with _results_lock:
+        entry = analysis_results.pop(analysis_id, None)
+        if entry is not None and analysis_id in _running:
+            _cancelled.add(analysis_id)
+        return entry
+
+
+def _prepare_jazz_result(res: dict) -> dict:
+    """Regelbasierter Teil des Ergebnisses (ohne Feedback): Report, Fakten,
+    Befunde. Schnell; laeuft inline (?wait=) oder im Queue-Job."""
+    report = res["report"]
     label = report.get("context", {}).get("label", "Ohne Harmonie-Kontext")
-    facts = jazz_service.facts_for_llm(report, summary, label)
+    return {
+        "tune": label,
+        "report": report,
+        "summary": res["summary"],
+        "used": res["used"],
+        "facts": jazz_service.facts_for_llm(report, res["summary"], label),
+        "findings": jazz_service.report_findings(report),
+    }
+
+
+def _with_feedback(prepared: dict, feedback: Optional[Dict], ai_generated: bool,
+                   ai_partial: Optional[List[str]] = None) -> dict:
+    """Vollstaendiges Ergebnis; ohne feedback regelbasiert. ai_partial: die
+    Kategorien, die trotz regelbasiertem Rest vom Modell stammen."""
+    feedback = feedback or generate_rule_based_feedback({}, {})
+    overall = (feedback["rhythm"]["score"] + feedback["harmony"]["score"]
+               + feedback["melody"]["score"] + feedback["articulation"]["score"]) / 4
+    out = {"overall_score": round(overall, 1), **prepared,
+           "feedback": feedback, "ai_generated": ai_generated}
+    if ai_partial:
+        out["ai_partial"] = ai_partial
+    return out
+
+
+def _attach_feedback(analysis_id: str, prepared: dict):
+    """LLM-Phase: Apertus -> Score -> Ergebnis ablegen. Abbruch-Checkpoints
+    vor dem LLM-Aufruf und pro gestreamtem Textstueck."""
+    import asyncio
+    if not _write_entry(analysis_id, {"status": "processing", "stage": "ai"}):
+        return
+    partial = {}
+
+    def on_section(category, section):
+        # fertige Kategorien sofort sichtbar machen (GET /result, /events)
+        if category in FEEDBACK_CATEGORIES and "score" in section:
+            partial[category] = section
+            _write_entry(analysis_id, {"status": "processing", "stage": "ai",
+                                       "partial_feedback": dict(partial)})
 
-    analysis_results[analysis_id] = {"status": "processing", "stage": "ai"}
     loop = asyncio.new_event_loop(); asyncio.set_event_loop(loop)
-    feedback = loop.run_until_complete(get_apertus_feedback_grounded(facts, label))
+    feedback = loop.run_until_complete(get_apertus_feedback_grounded(
+        prepared["facts"], prepared["tune"], _knowledge_context_for(prepared["findings"]),
+        on_section, should_abort=lambda: _cancel_requested(analysis_id)))
     loop.close()
+    if _cancel_requested(analysis_id):
+        return
 
     ai_generated = feedback is not None
+    ai_partial = None
     if not feedback:
-        feedback = generate_rule_based_feedback({}, {})
-    overall = (feedback["rhythm"]["score"] + feedback["harmony"]["score"]
-               + feedback["melody"]["score"] + feedback["articulation"]["score"]) / 4
+        # Abbruch mitten im Stream: schon gezeigte Kategorien behalten, aber
+        # als Modelltext kennzeichnen (Rest ist regelbasiert)
+        feedback = {**generate_rule_based_feedback({}, {}), **partial}
+        ai_partial = [c for c in FEEDBACK_CATEGORIES if c in partial]
+    _write_entry(analysis_id, {"status": "completed",
+                                "result": _with_feedback(prepared, feedback, ai_generated,
+                                                         ai_partial)})
+
+
+def _finish_jazz_analysis(analysis_id: str, res: dict, llm: bool = True,
+                          prepared: Optional[dict] = None):
+    """Gemeinsamer Abschluss fuer MIDI- und Audio/Note-Events-Pfad:
+    Fakten -> Apertus -> Score -> Ergebnis ablegen (llm=False: regelbasiert).
+    Abgebrochene Jobs (DELETE /result) enden hier ohne LLM-Aufruf."""
+    if _cancel_requested(analysis_id):
+        return
+    if not res.get("ok"):
+        _write_entry(analysis_id, {"status": "error",
+                                   "error": res.get("error", "Analyse fehlgeschlagen.")})
+        return
+    prepared = prepared or _prepare_jazz_result(res)
+    if not llm:
+        _write_entry(analysis_id, {"status": "completed",
+                                   "result": _with_feedback(prepared, None, False)})
+        return
+    _submit_llm_phase(analysis_id, prepared)
+
+
+def _run_llm_phase(analysis_id: str, prepared: dict):
+    try:
+        _attach_feedback(analysis_id, prepared)
+    finally:
+        _phase_done(analysis_id)
+
+
+def _submit_llm_phase(analysis_id: str, prepared: dict):
+    """LLM-Phase an llm_jobs abgeben; der Analyse-Worker ist sofort wieder
+    frei. llm_jobs voll -> regelbasiertes Ergebnis (wie ein Dispatcher-Timeout)."""
+    if not _write_entry(analysis_id, {"status": "processing", "stage": "ai"}):
+        return
+    _phase_started(analysis_id)
+    try:
+        llm_jobs.submit(_run_llm_phase, analysis_id, prepared, key=analysis_id,
+                        priority=getattr(_job_ctx, "priority", job_queue.INTERACTIVE))
+    except job_queue.QueueFull:
+        _phase_done(analysis_id)
+        _write_entry(analysis_id, {"status": "completed",
+                                   "result": _with_feedback(prepared, None, False)})
+
+
+# --- Dedup identischer Anfragen ---------------------------------------------
+# fingerprint (jazz_service.request_fingerprint) -> analysis_id. Ein Treffer
+# liefert den vorhandenen Job: fertig -> Ergebnis, laufend -> dieselbe ID
+# (der Client haengt sich an). Fehlgeschlagene/geloeschte Jobs zaehlen nicht.
+# llm=0 und llm=1 haben getrennte Fingerprints (anderes Ergebnis).
+# LRU wie _result_bytes: aelteste Fingerprints fallen nach DEDUP_INDEX_SIZE
+# raus (kostet nur den Dedup-Treffer, nicht das Ergebnis).
+DEDUP_INDEX_SIZE = int(os.environ.get("DEDUP_INDEX_SIZE", "4096"))
+_dedup_index: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _dedup_lookup(fingerprint: str) -> Optional[str]:
+    analysis_id = _dedup_index.get(fingerprint)
+    entry = analysis_results.get(analysis_id) if analysis_id else None
+    if entry is None or entry.get("status") == "error":
+        _dedup_index.pop(fingerprint, None)
+        return None
+    _dedup_index.move_to_end(fingerprint)
+    return analysis_id
+
+
+async def _dedup_response(analysis_id: str, wait: float) -> Response:
+    """Mit wait: bis zu wait Sekunden auf den laufenden Job warten, damit der
+    Client wie beim Schnellpfad ein fertiges Ergebnis bekommt."""
+    import asyncio
+    entry = analysis_results[analysis_id]
+    deadline = asyncio.get_running_loop().time() + min(wait, SYNC_WAIT_MAX)
+    while entry["status"] == "processing" and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.05)
+        entry = analysis_results.get(analysis_id) or {"status": "error", "error": "Job entfernt"}
+    out = {"analysis_id": analysis_id, "status": entry["status"], "deduplicated": True}
+    for key in ("stage", "error"):
+        if key in entry:
+            out[key] = entry[key]
+    if wait > 0 and entry["status"] == "completed":
+        out["result"] = entry["result"]
+    return FastJSONResponse(out)
+
+
+# --- Admission Control ------------------------------------------------------
+# Voll -> 429 mit Retry-After, bevor ein Eintrag im Result-Store entsteht.
+# Client = Peer-Adresse; hinter TRUSTED_PROXY_HOPS eigenen Proxies der Eintrag,
+# den der aeusserste davon an X-Forwarded-For angehaengt hat. Alles weiter
+# links kommt vom Client selbst und zaehlt nicht.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "0"))
+
+
+def _client_id(request: Request) -> str:
+    peer = request.client.host if request.client else "unknown"
+    if TRUSTED_PROXY_HOPS <= 0:
+        return peer
+    hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    return hops[-TRUSTED_PROXY_HOPS] if len(hops) >= TRUSTED_PROXY_HOPS else peer
+
+
+def _too_busy(e: job_queue.QueueFull) -> HTTPException:
+    return HTTPException(status_code=429, detail=e.reason,
+                         headers={"Retry-After": str(e.retry_after)})
+
+
+def _enqueue(analysis_id: str, fn, *args, client: Optional[str] = None,
+             priority: int = job_queue.INTERACTIVE, fingerprint: Optional[str] = None):
+    """Eintrag (stage queued) + Dedup registrieren, dann einreihen; bei
+    QueueFull beides zuruecknehmen und weiterwerfen."""
+    with _results_lock:
+        analysis_results[analysis_id] = {"status": "processing", "stage": "queued"}
+    if fingerprint:
+        _dedup_index[fingerprint] = analysis_id
+        _dedup_index.move_to_end(fingerprint)
+        while len(_dedup_index) > DEDUP_INDEX_SIZE:
+            _dedup_index.popitem(last=False)
+    try:
+        jobs.submit(_run_job, fn, analysis_id, priority, *args, client=client, priority=priority,
+                    key=analysis_id)
+    except job_queue.QueueFull:
+        with _results_lock:
+            analysis_results.pop(analysis_id, None)
+        if fingerprint:
+            _dedup_index.pop(fingerprint, None)
+        raise
+
+
+# --- Synchroner Schnellpfad (?wait=Sekunden) --------------------------------
+# Kleine Eingaben sind in Millisekunden analysiert: Report inline in derselben
+# Antwort statt Polling. Die Analyse ist trotzdem ein normaler Queue-Job
+# (gleiche Admission Control); der Request wartet hoechstens wait Sekunden auf
+# dessen Noten-Phase. Die LLM-Phase laeuft danach im selben Job weiter
+# (stage "ai"); dauert die Analyse laenger, pollt der Client wie gewohnt.
+SYNC_WAIT_MAX = float(os.environ.get("SYNC_WAIT_MAX", "10"))
+
+
+class _Handoff:
+    """Noten-Phase eines Jobs -> wartender Request (Event im Event-Loop)."""
+
+    def __init__(self):
+        import asyncio
+        self.loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+        self.res = None
+        self.prepared = None
+
+    def deliver(self, res: dict, prepared: Optional[dict]):
+        self.res, self.prepared = res, prepared
+        try:
+            self.loop.call_soon_threadsafe(self.ready.set)
+        except RuntimeError:
+            pass                               # Loop beendet, niemand wartet mehr
 
-    analysis_results[analysis_id] = {"status": "completed", "result": {
-        "overall_score": round(overall, 1),
-        "tune": label,
-        "report": report,
-        "summary": summary,
-        "used": used,
-        "facts": facts,
-        "feedback": feedback,
-        "ai_generated": ai_generated,
-    }}
+
+def _inline_job(analysis_id: str, analyze, handoff: _Handoff, llm: bool, upload=None):
+    """Queue-Job fuer ?wait=: analyze() -> Ergebnis an den wartenden Request,
+    danach wie jeder Job weiter (LLM-Phase bzw. Ergebnis ablegen)."""
+    try:
+        if not _write_entry(analysis_id, {"status": "processing", "stage": "notes"}):
+            return
+        res = analyze()
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        res = {"ok": False, "error": str(e)}
+    finally:
+        _close_upload(upload)
+    prepared = _prepare_jazz_result(res) if res.get("ok") else None
+    handoff.deliver(res, prepared)
+    _finish_jazz_analysis(analysis_id, res, llm, prepared)
+
+
+async def _analyze_inline(analyze, wait: float, llm: bool = True, upload=None,
+                          fingerprint: Optional[str] = None,
+                          client: Optional[str] = None) -> Response:
+    """analyze(): jazz_service-Aufruf ohne Argumente -> res. Antwort:
+    completed (ohne LLM), processing/stage ai mit vorlaeufigem result, oder
+    processing ohne result (Timeout -> Job laeuft weiter). Queue voll -> 429."""
+    import asyncio
+    analysis_id = str(uuid.uuid4())
+    handoff = _Handoff()
+    try:
+        _enqueue(analysis_id, _inline_job, analyze, handoff, llm, upload,
+                 client=client, fingerprint=fingerprint)
+    except job_queue.QueueFull as e:
+        _close_upload(upload)
+        raise _too_busy(e)
+    try:
+        await asyncio.wait_for(handoff.ready.wait(), timeout=min(wait, SYNC_WAIT_MAX))
+    except asyncio.TimeoutError:
+        return FastJSONResponse({"analysis_id": analysis_id, "status": "processing"})
+    res = handoff.res
+    if not res.get("ok"):
+        return FastJSONResponse({"status": "error", "error": res.get("error", "Analyse fehlgeschlagen.")})
+
+    result = _with_feedback(handoff.prepared, None, False)
+    if not (llm and apertus_enabled):
+        return FastJSONResponse({"analysis_id": analysis_id, "status": "completed", "result": result})
+    return FastJSONResponse({"analysis_id": analysis_id, "status": "processing",
+                             "stage": "ai", "result": {**result, "ai_pending": True}})
 
 
-def process_midi_jazz(analysis_id: str, tmp_path: str, context: dict,
-                      beats_per_bar: int, bpm: Optional[float]):
+def process_midi_jazz(analysis_id: str, midi, context: dict,
+                      beats_per_bar: int, bpm: Optional[float], llm: bool = True):
     import gc
     try:
-        analysis_results[analysis_id] = {"status": "processing", "stage": "notes"}
+        _write_entry(analysis_id, {"status": "processing", "stage": "notes"})
         res = jazz_service.analyze_midi(
-            tmp_path, context,
+            midi, context,
             beats_per_bar=(int(beats_per_bar) if beats_per_bar else None),
             bpm=(float(bpm) if bpm else None))
         gc.collect()
-        _finish_jazz_analysis(analysis_id, res)
+        _finish_jazz_analysis(analysis_id, res, llm)
     except Exception as e:
         import traceback; traceback.print_exc()
-        analysis_results[analysis_id] = {"status": "error", "error": str(e)}
+        _write_entry(analysis_id, {"status": "error", "error": str(e)})
     finally:
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+        _close_upload(midi)
 
 
 def process_notes_jazz(analysis_id: str, note_events: list, context: dict,
-                       beats_per_bar: int, bpm: Optional[float]):
-    """Pfad fuer im Browser transkribierte Audio-Aufnahmen (Basic Pitch)."""
+                       beats_per_bar: int, bpm: Optional[float], llm: bool = True):
+    """Pfad fuer im Browser transkribierte Audio-Aufnahmen (Basic Pitch).
+    note_events: JSON-Liste oder Spalten-Tupel aus dem Binaer-Upload."""
     import gc
     try:
-        analysis_results[analysis_id] = {"status": "processing", "stage": "notes"}
-        res = jazz_service.analyze_notes(
+        _write_entry(analysis_id, {"status": "processing", "stage": "notes"})
+        analyze = (jazz_service.analyze_note_columns if isinstance(note_events, tuple)
+                   else jazz_service.analyze_notes)
+        res = analyze(
             note_events, context,
             beats_per_bar=(int(beats_per_bar) if beats_per_bar else None),
             bpm=(float(bpm) if bpm else None))
         gc.collect()
-        _finish_jazz_analysis(analysis_id, res)
+        _finish_jazz_analysis(analysis_id, res, llm)
     except Exception as e:
         import traceback; traceback.print_exc()
-        analysis_results[analysis_id] = {"status": "error", "error": str(e)}
+        _write_entry(analysis_id, {"status": "error", "error": str(e)})
 
 
 # ============================================================================
 # API ENDPOINTS
 # ============================================================================
 
+# Uploads gehen ohne Temp-Datei an die Analyse: bis UPLOAD_MEMORY_MAX als
+# bytes, darueber in einer SpooledTemporaryFile (verschwindet beim close(),
+# auch wenn der Job abstuerzt). Groessere als MAX_UPLOAD_BYTES -> 413.
+UPLOAD_MEMORY_MAX = int(os.environ.get("UPLOAD_MEMORY_MAX", str(4 * 1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(32 * 1024 * 1024)))
+
+
+async def _read_upload(file: UploadFile):
+    """Upload -> bytes oder (gross) SpooledTemporaryFile; FastAPI schliesst
+    das UploadFile vor dem Job-Lauf, deshalb eine eigene Kopie."""
+    data = await file.read(UPLOAD_MEMORY_MAX + 1)
+    if len(data) <= UPLOAD_MEMORY_MAX:
+        return data
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_MEMORY_MAX)
+    spool.write(data)
+    while True:
+        chunk = await file.read(1024 * 1024)
+        if not chunk:
+            break
+        spool.write(chunk)
+        if spool.tell() > MAX_UPLOAD_BYTES:
+            spool.close()
+            raise HTTPException(status_code=413,
+                                detail=f"Datei zu gross (max. {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)")
+    spool.seek(0)
+    return spool
+
+
+def _close_upload(midi):
+    if hasattr(midi, "close"):
+        midi.close()
+
 @app.get("/standards")
 async def get_standards():
     """Liste der bekannten Standards (Anzeigenamen) fuer die UI."""
@@ -370,78 +784,517 @@ async def get_modes():
 
 
 @app.post("/analyze-jazz")
-async def analyze_jazz(background_tasks: BackgroundTasks,
+async def analyze_jazz(request: Request,
                        file: UploadFile = File(...),
                        tune: str = Form(""),
                        manual_changes: str = Form(""),
                        key_tonic: str = Form(""),
                        key_mode: str = Form(""),
                        beats_per_bar: int = Form(4),
-                       bpm: str = Form("")):
+                       bpm: str = Form(""),
+                       wait: float = 0, llm: bool = True):
     """MIDI + OPTIONALER Harmonie-Kontext -> jazzfb-Analyse -> Apertus.
-    Kontext-Precedence: eigene Changes > Tune > Tonart > keiner."""
+    Kontext-Precedence: eigene Changes > Tune > Tonart > keiner.
+    ?wait=Sekunden: Report inline zurueckgeben (siehe _analyze_inline)."""
     if not (file.filename.endswith('.mid') or file.filename.endswith('.midi')):
         raise HTTPException(status_code=400, detail="Aktuell nur MIDI-Dateien (.mid/.midi)")
+    midi = await _read_upload(file)
     analysis_id = str(uuid.uuid4())
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.mid') as tmp:
-        tmp.write(await file.read())
-        tmp_path = tmp.name
     try:
         bpm_val = float(bpm) if bpm.strip() else None
     except ValueError:
         bpm_val = None
     context = jazz_service.resolve_context(tune or None, manual_changes or None,
                                            key_tonic or None, key_mode or None)
-    background_tasks.add_task(process_midi_jazz, analysis_id, tmp_path,
-                             context, beats_per_bar, bpm_val)
+    fingerprint = jazz_service.request_fingerprint(midi, context, beats_per_bar, bpm_val, llm)
+    if (hit := _dedup_lookup(fingerprint)) is not None:
+        _close_upload(midi)
+        return await _dedup_response(hit, wait)
+    if wait > 0:
+        return await _analyze_inline(
+            lambda: jazz_service.analyze_midi(midi, context, beats_per_bar=beats_per_bar or None,
+                                              bpm=bpm_val),
+            wait, llm, upload=midi, fingerprint=fingerprint, client=_client_id(request))
+    try:
+        _enqueue(analysis_id, process_midi_jazz, midi, context, beats_per_bar, bpm_val, llm,
+                 client=_client_id(request), fingerprint=fingerprint)
+    except job_queue.QueueFull as e:
+        _close_upload(midi)
+        raise _too_busy(e)
     return {"analysis_id": analysis_id, "status": "processing"}
 
 
+def _notes_context(params) -> tuple:
+    """Kontextfelder aus JSON-Body bzw. Query-Parametern -> (context, bpb, bpm)."""
+    try:
+        bpm_val = float(params["bpm"]) if str(params.get("bpm", "")).strip() else None
+    except (ValueError, TypeError):
+        bpm_val = None
+    beats_per_bar = int(params.get("beats_per_bar") or 4)
+    context = jazz_service.resolve_context(
+        params.get("tune") or None, params.get("manual_changes") or None,
+        params.get("key_tonic") or None, params.get("key_mode") or None)
+    return context, beats_per_bar, bpm_val
+
+
 @app.post("/analyze-notes")
-async def analyze_notes_endpoint(background_tasks: BackgroundTasks, request: Request):
+async def analyze_notes_endpoint(request: Request,
+                                 wait: float = 0, llm: bool = True):
     """Audio-Pfad: der Browser transkribiert mit Basic Pitch und schickt die
     Note-Events als JSON. Body:
       { notes: [[start_s, end_s, pitch_midi, amplitude], ...],
-        tune?, manual_changes?, key_tonic?, key_mode?, beats_per_bar?, bpm? }"""
-    body = await request.json()
-    note_events = body.get("notes") or []
-    if not note_events:
+        tune?, manual_changes?, key_tonic?, key_mode?, beats_per_bar?, bpm? }
+    Alternativ binaer (Content-Type application/x-jazz-notes, optional gzip):
+    JZN1-Spalten, siehe jazz_service.decode_note_columns; Kontext dann als
+    Query-Parameter. ?wait=Sekunden: Report inline (siehe _analyze_inline)."""
+    if request.headers.get("content-type", "").startswith(jazz_service.NOTES_CONTENT_TYPE):
+        body = await request.body()
+        if len(body) > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="Body zu gross.")
+        try:
+            note_events = jazz_service.decode_note_columns(body)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        params = request.query_params
+    else:
+        params = await request.json()
+        note_events = params.get("notes") or []
+    if not len(note_events[0] if isinstance(note_events, tuple) else note_events):
         raise HTTPException(status_code=400, detail="Keine Note-Events uebergeben.")
-    try:
-        bpm_val = float(body["bpm"]) if str(body.get("bpm", "")).strip() else None
-    except (ValueError, TypeError):
-        bpm_val = None
-    beats_per_bar = int(body.get("beats_per_bar") or 4)
-    context = jazz_service.resolve_context(
-        body.get("tune") or None, body.get("manual_changes") or None,
-        body.get("key_tonic") or None, body.get("key_mode") or None)
+    context, beats_per_bar, bpm_val = _notes_context(params)
+    fingerprint = jazz_service.request_fingerprint(note_events, context, beats_per_bar, bpm_val, llm)
+    if (hit := _dedup_lookup(fingerprint)) is not None:
+        return await _dedup_response(hit, wait)
+    if wait > 0:
+        analyze = (jazz_service.analyze_note_columns if isinstance(note_events, tuple)
+                   else jazz_service.analyze_notes)
+        return await _analyze_inline(
+            lambda: analyze(note_events, context, beats_per_bar=beats_per_bar, bpm=bpm_val),
+            wait, llm, fingerprint=fingerprint, client=_client_id(request))
     analysis_id = str(uuid.uuid4())
-    background_tasks.add_task(process_notes_jazz, analysis_id, note_events,
-                             context, beats_per_bar, bpm_val)
+    try:
+        _enqueue(analysis_id, process_notes_jazz, note_events, context, beats_per_bar, bpm_val, llm,
+                 client=_client_id(request), fingerprint=fingerprint)
+    except job_queue.QueueFull as e:
+        raise _too_busy(e)
     return {"analysis_id": analysis_id, "status": "processing"}
 
 
+# --- Batch: ganze Klasse gegen denselben Kontext ----------------------------
+# Jede Datei wird ein normaler Job (analysis_id, Dedup, /result) auf der
+# Job-Queue, mit Batch-Prioritaet hinter den interaktiven Uploads. _watch_batch
+# meldet jede fertige Datei als Event und berechnet am Ende einmal die
+# Klassen-Auswertung. batch_results ist wie _result_bytes begrenzt
+# (BATCH_RESULTS_SIZE); verdraengt werden nur abgeschlossene Batches.
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "60"))
+BATCH_MAX_BYTES = int(os.environ.get("BATCH_MAX_BYTES", str(64 * 1024 * 1024)))
+BATCH_RESULTS_SIZE = int(os.environ.get("BATCH_RESULTS_SIZE", "64"))
+_batch_watchers = set()
+batch_results: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def _store_batch(batch_id: str, batch: dict):
+    batch_results[batch_id] = batch
+    excess = len(batch_results) - BATCH_RESULTS_SIZE
+    for old in [b for b, v in batch_results.items() if v["status"] != "processing"][:max(0, excess)]:
+        del batch_results[old]
+
+
+def _is_midi_name(name: str) -> bool:
+    return name.lower().endswith((".mid", ".midi"))
+
+
+async def _batch_items(files: List[UploadFile]) -> list:
+    """Uploads (MIDI-Dateien und/oder Zips mit MIDI-Dateien) -> [(name, midi)].
+
+    Anzahl und entpackte Gesamtgroesse werden vor jedem Lesen geprueft
+    (ZipInfo.file_size), damit ein Zip-Bomb gar nicht erst entpackt wird."""
+    import zipfile
+    items = []
+    total = 0
+
+    def admit(name: str, size: int):
+        nonlocal total
+        if len(items) >= BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Max. {BATCH_MAX_FILES} Dateien pro Batch")
+        if size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"{name}: Datei zu gross")
+        total += size
+        if total > BATCH_MAX_BYTES:
+            raise HTTPException(status_code=413,
+                                detail=f"Batch zu gross (max. {BATCH_MAX_BYTES // (1024 * 1024)} MB entpackt)")
+
+    for f in files:
+        name = f.filename or "upload"
+        if name.lower().endswith(".zip"):
+            data = await _read_upload(f)
+            try:
+                with zipfile.ZipFile(data if hasattr(data, "read") else io.BytesIO(data)) as z:
+                    for info in z.infolist():
+                        base = os.path.basename(info.filename)
+                        if info.is_dir() or not _is_midi_name(base) or info.filename.startswith("__MACOSX/"):
+                            continue
+                        # zipfile liest nie mehr als file_size -> Obergrenze haelt
+                        admit(base, info.file_size)
+                        items.append((base, z.read(info)))
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"{name}: kein gueltiges Zip")
+            finally:
+                _close_upload(data)
+        elif _is_midi_name(name):
+            midi = await _read_upload(f)
+            try:
+                admit(name, len(midi) if isinstance(midi, bytes) else midi.seek(0, io.SEEK_END))
+            except HTTPException:
+                _close_upload(midi)
+                raise
+            if not isinstance(midi, bytes):
+                midi.seek(0)
+            items.append((name, midi))
+        else:
+            raise HTTPException(status_code=400, detail=f"{name}: nur .mid/.midi oder .zip")
+    # eindeutige Namen (gleiche Dateinamen aus verschiedenen Zip-Ordnern)
+    seen = {}
+    for i, (name, midi) in enumerate(items):
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            items[i] = (f"{name} #{seen[name]}", midi)
+    return items
+
+
+async def _watch_batch(batch_id: str):
+    from starlette.concurrency import run_in_threadpool
+    batch = batch_results[batch_id]
+    pending = set(range(len(batch["files"])))
+    finished = {}              # index -> result, unabhaengig von spaeterem DELETE /result
+    try:
+        await _collect_batch(batch, pending, finished)
+        batch["summary"] = await run_in_threadpool(
+            jazz_service.class_summary, [(batch["files"][i]["name"], finished[i]) for i in sorted(finished)])
+        batch["status"] = "completed"
+        batch["events"].append({"type": "summary", "summary": batch["summary"]})
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        batch["status"] = "error"
+        batch["events"].append({"type": "error", "error": str(e)})
+    finally:
+        if batch["status"] == "processing":        # abgebrochen (z.B. Shutdown)
+            batch["status"] = "error"
+            batch["events"].append({"type": "error", "error": "Batch abgebrochen"})
+
+
+async def _collect_batch(batch: dict, pending: set, finished: dict):
+    import asyncio
+    while pending:
+        for i in sorted(pending):
+            f = batch["files"][i]
+            entry = analysis_results.get(f["analysis_id"]) or {"status": "error", "error": "Job entfernt"}
+            if entry.get("status") not in ("completed", "error"):
+                continue
+            pending.discard(i)
+            f["status"] = entry["status"]
+            event = {"type": "file", "index": i, "name": f["name"],
+                     "analysis_id": f["analysis_id"], "status": entry["status"]}
+            if entry["status"] == "completed":
+                finished[i] = entry["result"]
+                event["overall_score"] = entry["result"].get("overall_score")
+            else:
+                event["error"] = entry.get("error")
+            batch["done"] += 1
+            batch["events"].append(event)
+        if pending:
+            await asyncio.sleep(0.2)
+
+
+@app.post("/analyze-batch")
+async def analyze_batch(files: List[UploadFile] = File(...),
+                        tune: str = Form(""),
+                        manual_changes: str = Form(""),
+                        key_tonic: str = Form(""),
+                        key_mode: str = Form(""),
+                        beats_per_bar: int = Form(4),
+                        bpm: str = Form(""),
+                        llm: bool = True):
+    """Mehrere MIDI-Takes (Multipart-Liste und/oder Zip) mit EINEM Kontext.
+    Fortschritt: GET /batch/{id}/events (SSE, ein Event pro Datei, zuletzt die
+    Klassen-Auswertung) oder GET /batch/{id}. Einzelergebnisse unter /result."""
+    import asyncio
+    items = await _batch_items(files)
+    if not items:
+        raise HTTPException(status_code=400, detail="Keine MIDI-Dateien gefunden.")
+    try:
+        bpm_val = float(bpm) if bpm.strip() else None
+    except ValueError:
+        bpm_val = None
+    context = jazz_service.resolve_context(tune or None, manual_changes or None,
+                                           key_tonic or None, key_mode or None)
+    try:
+        jobs.check(priority=job_queue.BATCH, count=len(items))
+    except job_queue.QueueFull as e:
+        for _, midi in items:
+            _close_upload(midi)
+        raise _too_busy(e)
+    entries = []
+    for name, midi in items:
+        fingerprint = jazz_service.request_fingerprint(midi, context, beats_per_bar, bpm_val, llm)
+        hit = _dedup_lookup(fingerprint)
+        if hit is not None:
+            _close_upload(midi)
+            entries.append({"name": name, "analysis_id": hit, "status": "processing", "deduplicated": True})
+            continue
+        analysis_id = str(uuid.uuid4())
+        try:
+            _enqueue(analysis_id, process_midi_jazz, midi, context, beats_per_bar, bpm_val, llm,
+                     priority=job_queue.BATCH, fingerprint=fingerprint)
+        except job_queue.QueueFull as e:
+            # Platz war geprueft; nur bei parallelem Batch moeglich
+            _close_upload(midi)
+            with _results_lock:
+                analysis_results[analysis_id] = {"status": "error", "error": e.reason}
+        entries.append({"name": name, "analysis_id": analysis_id, "status": "processing"})
+
+    batch_id = str(uuid.uuid4())
+    _store_batch(batch_id, {"status": "processing", "total": len(entries), "done": 0,
+                            "files": entries, "events": [], "summary": None,
+                            "context": context.get("label")})
+    watcher = asyncio.ensure_future(_watch_batch(batch_id))
+    _batch_watchers.add(watcher)
+    watcher.add_done_callback(_batch_watchers.discard)
+    return {"batch_id": batch_id, "status": "processing", "total": len(entries),
+            "files": entries, "events": f"/batch/{batch_id}/events"}
+
+
+@app.get("/batch/{batch_id}")
+async def get_batch(batch_id: str):
+    if batch_id not in batch_results: raise HTTPException(status_code=404, detail="Not found")
+    batch = batch_results[batch_id]
+    return FastJSONResponse({k: v for k, v in batch.items() if k != "events"})
+
+
+@app.get("/batch/{batch_id}/events")
+async def batch_events(batch_id: str):
+    """Server-Sent Events: {"type": "file", ...} je fertiger Datei (auch die
+    schon fertigen beim Verbinden), zum Schluss {"type": "summary", ...} bzw.
+    {"type": "error", ...}."""
+    if batch_id not in batch_results: raise HTTPException(status_code=404, detail="Not found")
+    import asyncio
+    batch = batch_results[batch_id]
+
+    async def events():
+        sent = 0
+        while True:
+            while sent < len(batch["events"]):
+                event = batch["events"][sent]
+                sent += 1
+                yield b"data: " + dumps_json(event) + b"\n\n"
+                if event["type"] in ("summary", "error"):
+                    return
+            if batch["status"] != "processing":
+                return
+            await asyncio.sleep(0.2)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "Content-Encoding": "identity"})
+
+
 @app.post("/analyze-async")
-async def analyze_midi_async(background_tasks: BackgroundTasks, file: UploadFile = File(...), key: str = Form("C Major")):
+async def analyze_midi_async(request: Request, file: UploadFile = File(...), key: str = Form("C Major")):
     if not (file.filename.endswith('.mid') or file.filename.endswith('.midi')):
         raise HTTPException(status_code=400, detail="Nur MIDI-Dateien erlaubt")
     
+    midi = await _read_upload(file)
     analysis_id = str(uuid.uuid4())
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.mid') as tmp:
-        tmp.write(await file.read())
-        tmp_path = tmp.name
-    
-    background_tasks.add_task(process_midi_in_background, analysis_id, tmp_path, key)
+    try:
+        _enqueue(analysis_id, process_midi_in_background, midi, key, client=_client_id(request))
+    except job_queue.QueueFull as e:
+        _close_upload(midi)
+        raise _too_busy(e)
     return {"analysis_id": analysis_id, "status": "processing"}
 
+NOTES_VIEW_FORMATS = ("full", "columnar", "none")
+
+
+def _with_notes_view(entry: dict, notes_view: str) -> dict:
+    """Ergebnis mit notes_view im gewuenschten Format. Gespeichert wird
+    spaltenweise (jazz_service.encode_notes_view); 'full' = alte Dict-Liste."""
+    if notes_view not in NOTES_VIEW_FORMATS:
+        raise HTTPException(status_code=400, detail="notes_view: full|columnar|none")
+    report = entry.get("result", {}).get("report")
+    if notes_view == "columnar" or not report or "notes_view" not in report:
+        return entry
+    report = dict(report)
+    if notes_view == "full":
+        report["notes_view"] = jazz_service.notes_view_full(report["notes_view"])
+    else:
+        del report["notes_view"]
+    return {**entry, "result": {**entry["result"], "report": report}}
+
+
+# ?fields= Projektion: Komma-Liste von Pfaden ("status,feedback,report.time_feel");
+# Pfade ohne Top-Level-Schluessel beziehen sich auf "result". Mit "-" davor wird
+# ausgeschlossen ("result,-report.line.detail"). Die grossen Arrays gibt es
+# einzeln unter /result/{id}/sections/{name}.
+RESULT_ENTRY_KEYS = ("status", "stage", "error", "partial_feedback", "result")
+HEAVY_SECTIONS = {"notes_view": ("notes_view",),
+                  "line_detail": ("line", "detail"),
+                  "voicings": ("voicings", "voicings")}
+
+
+def _field_path(field: str) -> tuple:
+    parts = tuple(p for p in field.split(".") if p)
+    if not parts:
+        return ()
+    return parts if parts[0] in RESULT_ENTRY_KEYS else ("result",) + parts
+
+
+def _drop_path(d, path: tuple):
+    """Kopie von d ohne path (der gespeicherte Eintrag bleibt unveraendert)."""
+    if not isinstance(d, dict) or path[0] not in d:
+        return d
+    if len(path) == 1:
+        return {k: v for k, v in d.items() if k != path[0]}
+    return {**d, path[0]: _drop_path(d[path[0]], path[1:])}
+
+
+def _project(entry: dict, fields: str) -> dict:
+    include, exclude = [], []
+    for f in fields.split(","):
+        f = f.strip()
+        path = _field_path(f.lstrip("-"))
+        if path:
+            (exclude if f.startswith("-") else include).append(path)
+    out = {} if include else entry
+    done = []
+    for path in sorted(include, key=len):
+        if any(path[:len(d)] == d for d in done):
+            continue                          # schon ueber einen Praefix enthalten
+        src = entry
+        for key in path[:-1]:
+            src = src.get(key) if isinstance(src, dict) else None
+        if not (isinstance(src, dict) and path[-1] in src):
+            continue                          # Pfad existiert nicht -> nichts erfinden
+        dst = out
+        for key in path[:-1]:
+            dst = dst.setdefault(key, {})
+        dst[path[-1]] = src[path[-1]]
+        done.append(path)
+    for path in exclude:
+        out = _drop_path(out, path)
+    return out
+
+
+def _result_view(entry: dict, fields: Optional[str], notes_view: str) -> dict:
+    if fields:
+        entry = _project(entry, fields)
+    return _with_notes_view(entry, notes_view)
+
+
+# Fertige Ergebnisse aendern sich nicht mehr: je (id, fields, notes_view)
+# einmal serialisieren. Der Eintrag selbst dient als Versionsmarke (neues
+# Dict in analysis_results -> Cache-Eintrag ungueltig).
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "256"))
+_result_bytes: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+
+def _result_response(analysis_id: str, fields: Optional[str], notes_view: str) -> Response:
+    entry = analysis_results[analysis_id]
+    if entry.get("status") != "completed":
+        return FastJSONResponse(_result_view(entry, fields, notes_view))
+    key = (analysis_id, fields or "", notes_view)
+    hit = _result_bytes.get(key)
+    if hit is None or hit[0] is not entry:
+        hit = (entry, dumps_json(_result_view(entry, fields, notes_view)))
+        _result_bytes[key] = hit
+        while len(_result_bytes) > RESULT_CACHE_SIZE:
+            _result_bytes.popitem(last=False)
+    else:
+        _result_bytes.move_to_end(key)
+    return FastJSONResponse(hit[1])
+
+
 @app.get("/result/{analysis_id}")
-async def get_result(analysis_id: str):
+async def get_result(analysis_id: str, notes_view: str = "full", fields: Optional[str] = None):
+    """notes_view: full (Dict pro Note, Default), columnar (kompakt) oder none.
+    fields: Projektion, z.B. ?fields=status,stage fuers Polling."""
+    if analysis_id not in analysis_results: raise HTTPException(status_code=404, detail="Not found")
+    return _result_response(analysis_id, fields, notes_view)
+
+@app.delete("/result/{analysis_id}")
+async def delete_result(analysis_id: str):
+    """Job abbrechen bzw. Ergebnis verwerfen (z.B. neuer Upload mit anderem
+    Tune/BPM). Wartend -> aus der Queue; laufend -> Abbruch am naechsten
+    Checkpoint, ohne weiteren LLM-Aufruf. Auch per Dedup angehaengte Clients
+    verlieren den Job."""
+    entry = _cancel_entry(analysis_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    for fingerprint in [f for f, aid in _dedup_index.items() if aid == analysis_id]:
+        _dedup_index.pop(fingerprint, None)
+    for key in [k for k in _result_bytes if k[0] == analysis_id]:
+        _result_bytes.pop(key, None)
+    if entry.get("status") != "processing":
+        return {"analysis_id": analysis_id, "status": "deleted"}
+    # laufend: Flag ist gesetzt (Checkpoints); wartend: aus der Queue nehmen
+    for arg in jobs.cancel(analysis_id) or ():
+        _close_upload(arg)                     # Spool-Datei eines wartenden Uploads
+    if llm_jobs.cancel(analysis_id) is not None:
+        _phase_done(analysis_id)               # LLM-Phase wartete noch auf einen Worker
+    return {"analysis_id": analysis_id, "status": "cancelled"}
+
+@app.get("/result/{analysis_id}/sections/{section}")
+async def get_result_section(analysis_id: str, section: str, notes_view: str = "full"):
+    """Einzelne grosse Report-Arrays (notes_view, line_detail, voicings) erst
+    dann laden, wenn sie gebraucht werden (z.B. Piano-Roll)."""
+    if analysis_id not in analysis_results: raise HTTPException(status_code=404, detail="Not found")
+    if section not in HEAVY_SECTIONS:
+        raise HTTPException(status_code=404, detail="Sektionen: " + ", ".join(HEAVY_SECTIONS))
+    entry = analysis_results[analysis_id]
+    if entry.get("status") != "completed":
+        raise HTTPException(status_code=409, detail="Analyse noch nicht fertig.")
+    data = entry["result"].get("report", {})
+    for key in HEAVY_SECTIONS[section]:
+        data = data.get(key) if isinstance(data, dict) else None
+    if data is None:
+        raise HTTPException(status_code=404, detail="Sektion nicht im Report.")
+    if section == "notes_view":
+        if notes_view not in ("full", "columnar"):
+            raise HTTPException(status_code=400, detail="notes_view: full|columnar")
+        if notes_view == "full":
+            data = jazz_service.notes_view_full(data)
+    return FastJSONResponse(data)
+
+@app.get("/result/{analysis_id}/events")
+async def result_events(analysis_id: str, notes_view: str = "full", fields: Optional[str] = None):
+    """Server-Sent Events: ein Snapshot wie GET /result bei jeder Aenderung
+    (Stage, neue Feedback-Kategorie), Ende nach completed/error."""
     if analysis_id not in analysis_results: raise HTTPException(status_code=404, detail="Not found")
-    return analysis_results[analysis_id]
+    if notes_view not in NOTES_VIEW_FORMATS:
+        raise HTTPException(status_code=400, detail="notes_view: full|columnar|none")
+    import asyncio
+
+    async def events():
+        last = None
+        while True:
+            entry = analysis_results.get(analysis_id)
+            if entry is None:
+                return
+            if entry is not last:
+                last = entry
+                view = _result_view(entry, fields, notes_view)
+                yield b"data: " + dumps_json(view) + b"\n\n"
+                if entry.get("status") in ("completed", "error"):
+                    return
+            await asyncio.sleep(0.1)
+
+    # identity: die GZip-Middleware puffert Streams sonst bis zum Ende
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "Content-Encoding": "identity"})
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "ai_enabled": apertus_enabled}
+    return {"status": "healthy", "ai_enabled": apertus_enabled,
+            "knowledge_base": knowledge_status(), "llm_dispatch": dispatcher.status(),
+            "jobs": jobs.status(), "llm_jobs": llm_jobs.status()}
 
 if __name__ == "__main__":
     import uvicorn
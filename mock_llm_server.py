@@ -0,0 +1,284 @@
+"""
+mock_llm_server.py — lokaler, OpenAI-kompatibler LLM-Endpunkt fuer Last- und
+Latenztests (nur Standardbibliothek).
+
+Simuliert konfigurierbare Latenzverteilungen, Fehlerraten und ein Rate-Limit
+(Token-Bucket -> 429 mit Retry-After). Antworten sind deterministisch
+(llm_backend.stub_feedback) und im Score-JSON-Format der App. Mit
+"stream": true kommt die Antwort als Server-Sent Events (chat.completion.chunk),
+die Latenz verteilt sich dann auf die Stuecke.
+
+    python mock_llm_server.py serve --port 8081 --latency lognormal:0.8,0.5 \\
+        --error-rate 0.05 --rate-limit 4 --burst 8
+    # App dagegen laufen lassen:
+    LLM_BACKEND=router LLM_URL=http://127.0.0.1:8081/v1/chat/completions \\
+        LLM_TOKEN=mock uvicorn main:app
+
+    # End-to-end-Durchsatz der Jobs (Server laeuft im selben Prozess):
+    python mock_llm_server.py bench --jobs 40 --concurrency 8 --latency uniform:0.2,1.0
+
+Latenz-Spezifikation: fixed:S | uniform:A,B | normal:MU,SIGMA |
+lognormal:MEDIAN,SIGMA (Sekunden).
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from llm_backend import stream_chunks, stub_feedback
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """'lognormal:0.8,0.5' -> Sampler (rng -> Sekunden, >= 0)."""
+    kind, _, args = spec.partition(":")
+    vals = [float(x) for x in args.split(",") if x.strip()] if args else []
+    if kind == "fixed":
+        return lambda rng: vals[0] if vals else 0.0
+    if kind == "uniform":
+        return lambda rng: rng.uniform(vals[0], vals[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(vals[0], vals[1]))
+    if kind == "lognormal":
+        mu = math.log(vals[0])
+        return lambda rng: rng.lognormvariate(mu, vals[1])
+    raise ValueError(f"Unbekannte Latenz-Spezifikation: {spec!r}")
+
+
+class MockState:
+    """Konfiguration + Zaehler, von allen Handler-Threads geteilt."""
+
+    def __init__(self, latency: str = "fixed:0", error_rate: float = 0.0,
+                 rate_limit: float = 0.0, burst: int = 0, seed: int = 0):
+        self.sample_latency = parse_latency(latency)
+        self.latency_spec = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit            # Anfragen/Sekunde, 0 = aus
+        self.burst = burst or max(1, int(math.ceil(rate_limit)))
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = float(self.burst)
+        self.refilled_at = time.monotonic()
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0}
+
+    def admit(self) -> float:
+        """Token-Bucket: 0.0 = zugelassen, sonst Sekunden bis zum naechsten Token."""
+        if not self.rate_limit:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate_limit)
+            self.refilled_at = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return 0.0
+            return (1.0 - self.tokens) / self.rate_limit
+
+    def draw(self) -> tuple[float, bool]:
+        with self.lock:
+            return self.sample_latency(self.rng), self.rng.random() < self.error_rate
+
+    def count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+    def describe(self) -> dict:
+        with self.lock:
+            return {"latency": self.latency_spec, "error_rate": self.error_rate,
+                    "rate_limit": self.rate_limit, "burst": self.burst, **self.stats}
+
+
+def make_handler(state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):     # kein Log pro Anfrage
+            pass
+
+        def _send(self, code: int, body: dict, headers: dict | None = None):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _write_chunk(self, data: bytes):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def _send_stream(self, content: str, model: str, latency: float):
+            """SSE im OpenAI-Format, chunked uebertragen."""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            pieces = stream_chunks(content)
+            for piece in pieces:
+                time.sleep(latency / len(pieces))
+                chunk = {"object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": piece}}]}
+                self._write_chunk(b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n")
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                self._send(200, state.describe())
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send(400, {"error": {"message": "invalid JSON"}})
+                return
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": "not found"})
+                return
+            state.count("requests")
+
+            wait = state.admit()
+            if wait:
+                state.count("rate_limited")
+                self._send(429, {"error": {"message": "rate limit exceeded"}},
+                           {"Retry-After": str(max(1, math.ceil(wait)))})
+                return
+
+            latency, fail = state.draw()
+            stream = bool(payload.get("stream"))
+            if not stream:
+                time.sleep(latency)
+            if fail:
+                state.count("errors")
+                self._send(503, {"error": {"message": "simulated upstream error"}})
+                return
+
+            messages = payload.get("messages") or [{}]
+            prompt = next((m.get("content", "") for m in reversed(messages)
+                           if m.get("role") == "user"), "")
+            content = json.dumps(stub_feedback(prompt), ensure_ascii=False)
+            state.count("ok")
+            if stream:
+                self._send_stream(content, payload.get("model", "mock"), latency)
+                return
+            self._send(200, {
+                "id": f"mock-{state.stats['requests']}",
+                "object": "chat.completion",
+                "model": payload.get("model", "mock"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": len(prompt) // 4,
+                          "completion_tokens": len(content) // 4},
+            })
+
+    return Handler
+
+
+def start_server(state: MockState, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Startet den Server in einem Daemon-Thread (port=0: freier Port)."""
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+    return server
+
+
+# --- End-to-end-Benchmark ---------------------------------------------------
+
+def _synthetic_notes(n_bars: int = 16, bpm: float = 160.0) -> list:
+    """Deterministische Achtel-Linie + Halbe-Voicings (Basic-Pitch-Format)."""
+    rng = random.Random(1)
+    spb = 60.0 / bpm
+    events, pitch = [], 67
+    for beat in range(n_bars * 4):
+        t = beat * spb
+        for k in (0.0, 0.62):                  # geswingte Achtel
+            pitch = min(84, max(60, pitch + rng.choice((-2, -1, 1, 2, 3, -3))))
+            events.append([t + k * spb, t + (k + 0.4) * spb, pitch, 0.7])
+        if beat % 2 == 0:
+            for p in (48, 53, 57):
+                events.append([t, t + 1.8 * spb, p, 0.5])
+    return events
+
+
+def run_bench(state: MockState, jobs: int, concurrency: int) -> dict:
+    from concurrent.futures import ThreadPoolExecutor
+
+    server = start_server(state)
+    os.environ["LLM_BACKEND"] = "router"
+    os.environ["LLM_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    os.environ["LLM_TOKEN"] = "mock"
+    import main                                # liest die Backend-Konfiguration beim Import
+    import jazz_service
+
+    ctx = jazz_service.resolve_context(None, "| Dm7 G7 | Cmaj7 | Cmaj7 |", None, None)
+
+    def job(i: int) -> float:
+        t = time.perf_counter()
+        res = jazz_service.analyze_notes(_synthetic_notes(), ctx, bpm=160.0)
+        main._finish_jazz_analysis(f"bench-{i}", res)
+        return time.perf_counter() - t
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        durations = sorted(pool.map(job, range(jobs)))
+    wall = time.perf_counter() - t0
+    server.shutdown()
+
+    results = [main.analysis_results.get(f"bench-{i}", {}) for i in range(jobs)]
+    ai = sum(1 for r in results if r.get("result", {}).get("ai_generated"))
+    pct = lambda q: round(durations[min(len(durations) - 1, int(q * len(durations)))], 3)
+    return {
+        "jobs": jobs, "concurrency": concurrency,
+        "wall_s": round(wall, 2), "jobs_per_s": round(jobs / wall, 2),
+        "latency_p50_s": pct(0.5), "latency_p95_s": pct(0.95), "latency_max_s": round(durations[-1], 3),
+        "ai_generated": ai, "fallback": jobs - ai,
+        "server": state.describe(),
+        "dispatch": main.dispatcher.status(),
+    }
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description="Lokaler Mock-LLM-Server / Durchsatz-Benchmark")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name in ("serve", "bench"):
+        p = sub.add_parser(name)
+        p.add_argument("--latency", default="lognormal:0.8,0.5")
+        p.add_argument("--error-rate", type=float, default=0.0)
+        p.add_argument("--rate-limit", type=float, default=0.0, help="Anfragen/Sekunde (0 = aus)")
+        p.add_argument("--burst", type=int, default=0)
+        p.add_argument("--seed", type=int, default=0)
+        if name == "serve":
+            p.add_argument("--host", default="127.0.0.1")
+            p.add_argument("--port", type=int, default=8081)
+        else:
+            p.add_argument("--jobs", type=int, default=40)
+            p.add_argument("--concurrency", type=int, default=8)
+    args = ap.parse_args()
+    state = MockState(args.latency, args.error_rate, args.rate_limit, args.burst, args.seed)
+
+    if args.cmd == "serve":
+        server = start_server(state, args.host, args.port)
+        print(f"🧪 Mock LLM on http://{args.host}:{server.server_address[1]}/v1/chat/completions "
+              f"({state.describe()})")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        print(json.dumps(run_bench(state, args.jobs, args.concurrency), indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
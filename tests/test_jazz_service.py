@@ -0,0 +1,56 @@
+import gzip
+import unittest
+
+import numpy as np
+
+import jazz_service
+
+
+class NoteColumnsTest(unittest.TestCase):
+    EVENTS = [[0.0, 0.5, 60, 0.8], [0.5, 1.25, 64, 0.5], [1.0, 2.0, 67, 1.0]]
+
+    def test_roundtrip(self):
+        start, end, pitch, amp = jazz_service.decode_note_columns(
+            jazz_service.encode_note_columns(self.EVENTS))
+        ev = np.asarray(self.EVENTS)
+        np.testing.assert_allclose(start, ev[:, 0])
+        np.testing.assert_allclose(end, ev[:, 1])
+        np.testing.assert_array_equal(pitch, ev[:, 2])
+        np.testing.assert_allclose(amp, ev[:, 3], atol=1 / 255)
+
+    def test_roundtrip_gzip(self):
+        body = gzip.compress(jazz_service.encode_note_columns(self.EVENTS))
+        pitch = jazz_service.decode_note_columns(body)[2]
+        self.assertEqual(pitch.tolist(), [60, 64, 67])
+
+    def test_corrupt_gzip_is_value_error(self):
+        body = gzip.compress(jazz_service.encode_note_columns(self.EVENTS))
+        with self.assertRaises(ValueError):
+            jazz_service.decode_note_columns(body[:10] + b"\xff" * 20 + body[30:])
+
+    def test_wrong_length_is_value_error(self):
+        with self.assertRaises(ValueError):
+            jazz_service.decode_note_columns(jazz_service.encode_note_columns(self.EVENTS)[:-1])
+        with self.assertRaises(ValueError):
+            jazz_service.decode_note_columns(b"nope")
+
+
+class ClassSummaryTest(unittest.TestCase):
+    @staticmethod
+    def result(score, avoid):
+        return {"overall_score": score, "findings": ["dense_line"] if avoid else [],
+                "report": {"line": {"avoid_notes_on_strong_beats": [{"pitch": 61}] * avoid,
+                                    "stepwise_ratio": 0.5}}}
+
+    def test_avoid_notes_are_counted(self):
+        summary = jazz_service.class_summary([("a", self.result(7.0, 0)),
+                                              ("b", self.result(6.0, 3))])
+        avoid = summary["metrics"]["avoid_notes_on_strong_beats"]
+        self.assertEqual(avoid["values"], {"a": 0, "b": 3})
+        self.assertEqual(avoid["max"], 3)
+        self.assertEqual(summary["metrics"]["stepwise_ratio"]["n"], 2)
+        self.assertEqual(summary["findings"], [{"finding": "dense_line", "count": 1, "share": 0.5}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import contextlib
+import io
+import threading
+import time
+import unittest
+
+from job_queue import BATCH, INTERACTIVE, JobQueue, QueueFull
+
+
+def noop(*args):
+    pass
+
+
+class JobQueueTest(unittest.TestCase):
+    """Ein Worker, der per Gate blockiert: alles danach bleibt in der Queue."""
+
+    def setUp(self):
+        self.gate = threading.Event()
+        self.started = threading.Event()
+
+    def tearDown(self):
+        self.gate.set()
+
+    def make_queue(self, **kw):
+        q = JobQueue(workers=1, **kw)
+        q.submit(self._blocker)
+        self.assertTrue(self.started.wait(5))
+        return q
+
+    def _blocker(self):
+        self.started.set()
+        self.gate.wait(5)
+
+    def wait_for(self, q, pred, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        with q.cond:
+            while not pred():
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    self.fail("Bedingung nicht erreicht")
+                q.cond.wait(0.01)
+
+    def test_queue_full_per_class(self):
+        q = self.make_queue(max_depth=2, max_batch_depth=3)
+        q.submit(noop, client="a")
+        q.submit(noop, client="b")
+        with self.assertRaises(QueueFull) as ctx:
+            q.submit(noop, client="c")
+        self.assertIn("interactive", ctx.exception.reason)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+
+        # Batch hat eigene Tiefe und ist von der vollen interaktiven Klasse unberuehrt
+        for _ in range(3):
+            q.submit(noop, priority=BATCH)
+        with self.assertRaises(QueueFull) as ctx:
+            q.submit(noop, priority=BATCH)
+        self.assertIn("batch", ctx.exception.reason)
+        self.assertEqual(q.status()["rejected_full"], 2)
+        self.assertEqual(q.status()["queued"], {"interactive": 2, "batch": 3})
+
+    def test_batch_all_or_nothing(self):
+        q = self.make_queue(max_batch_depth=3)
+        q.submit(noop, priority=BATCH)
+        with self.assertRaises(QueueFull):
+            q.check(priority=BATCH, count=3)
+        q.check(priority=BATCH, count=2)
+        # check() reiht nichts ein, auch nicht bei Erfolg
+        self.assertEqual(q.status()["queued"]["batch"], 1)
+
+    def test_client_limit_released_after_failure(self):
+        q = self.make_queue(per_client=1)
+
+        def boom():
+            raise RuntimeError("kaputt")
+
+        q.submit(boom, client="a")
+        with self.assertRaises(QueueFull):
+            q.submit(noop, client="a")
+        self.assertEqual(q.status()["rejected_client"], 1)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.gate.set()
+            self.wait_for(q, lambda: q.stats["failed"] == 1)
+        self.assertEqual(q.clients, {})
+        q.submit(noop, client="a")
+
+    def test_client_limit_released_after_cancel(self):
+        q = self.make_queue(per_client=1)
+        q.submit(noop, "x", client="a", key="job-1")
+        self.assertEqual(q.cancel("job-1"), ("x",))
+        self.assertIsNone(q.cancel("job-1"))
+        self.assertEqual(q.clients, {})
+        self.assertEqual(q.status()["queued"]["interactive"], 0)
+        self.assertEqual(q.status()["cancelled"], 1)
+        q.submit(noop, client="a")
+
+    def test_priority_order(self):
+        q = self.make_queue()
+        order = []
+        q.submit(order.append, "b1", priority=BATCH)
+        q.submit(order.append, "i1", priority=INTERACTIVE)
+        q.submit(order.append, "b2", priority=BATCH)
+        q.submit(order.append, "i2", priority=INTERACTIVE)
+        self.gate.set()
+        self.wait_for(q, lambda: q.stats["completed"] == 5)
+        self.assertEqual(order, ["i1", "i2", "b1", "b2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
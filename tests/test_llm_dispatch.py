@@ -0,0 +1,68 @@
+import threading
+import time
+import unittest
+
+from llm_dispatch import LLMDispatcher
+
+
+class GateBackend:
+    """Haelt jeden Aufruf fest, bis gate gesetzt ist."""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.entered = threading.Event()
+
+    def complete(self, prompt, **kwargs):
+        self.entered.set()
+        self.gate.wait(5)
+        return "ok"
+
+
+class DispatcherBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = GateBackend()
+        self.dispatcher = LLMDispatcher(self.backend, rate=0, max_in_flight=1,
+                                        queue_timeout=0.3, failure_threshold=1,
+                                        reset_after=0.05)
+        # Ein laufender Aufruf belegt den einzigen Slot
+        self.holder = threading.Thread(target=self.dispatcher.complete, args=("a",))
+        self.holder.start()
+        self.assertTrue(self.backend.entered.wait(5))
+
+    def tearDown(self):
+        self.backend.gate.set()
+        self.holder.join(5)
+
+    def open_then_half_open(self):
+        breaker = self.dispatcher.breaker
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        time.sleep(0.06)
+
+    def test_probe_queue_timeout_does_not_reopen(self):
+        self.open_then_half_open()
+        self.assertIsNone(self.dispatcher.complete("probe"))   # kein Slot frei
+        breaker = self.dispatcher.breaker
+        self.assertEqual(breaker.state, "half_open")
+        self.assertFalse(breaker.probe_running)
+        self.assertEqual(self.dispatcher.stats["queue_timeouts"], 1)
+        # Probe-Slot ist wieder frei
+        self.assertEqual(breaker.allow(), (True, True))
+
+    def test_non_probe_timeout_leaves_probe_alone(self):
+        # Wartet im closed-Zustand auf einen Slot ...
+        waiter = threading.Thread(target=self.dispatcher.complete, args=("b",))
+        waiter.start()
+        time.sleep(0.01)
+        # ... waehrenddessen oeffnet der Breaker und jemand anders nimmt die Probe
+        self.open_then_half_open()
+        self.assertEqual(self.dispatcher.breaker.allow(), (True, True))
+        waiter.join(5)
+        breaker = self.dispatcher.breaker
+        self.assertEqual(self.dispatcher.stats["queue_timeouts"], 1)
+        self.assertEqual(breaker.state, "half_open")
+        self.assertTrue(breaker.probe_running)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,220 @@
+import asyncio
+import contextlib
+import io
+import json
+import threading
+import time
+import unittest
+import uuid
+import zipfile
+from unittest import mock
+
+from fastapi import HTTPException, UploadFile
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+
+
+def section(text):
+    return {"score": 8.0, "feedback": text, "tips": ["a", "b", "c"]}
+
+
+class AttachFeedbackTest(unittest.TestCase):
+    PREPARED = {"facts": "", "tune": "Blues in F", "findings": []}
+
+    def run_feedback(self, fake):
+        analysis_id = str(uuid.uuid4())
+        main.analysis_results[analysis_id] = {"status": "processing"}
+        self.addCleanup(main.analysis_results.pop, analysis_id, None)
+        with mock.patch.object(main, "get_apertus_feedback_grounded", fake):
+            main._attach_feedback(analysis_id, dict(self.PREPARED))
+        return main.analysis_results[analysis_id]["result"]
+
+    def test_aborted_stream_marks_partial_sections(self):
+        async def fake(facts, tune, knowledge, on_section, should_abort=None):
+            on_section("harmony", section("vom Modell"))
+            return None                          # Stream mittendrin abgebrochen
+
+        result = self.run_feedback(fake)
+        self.assertFalse(result["ai_generated"])
+        self.assertEqual(result["ai_partial"], ["harmony"])
+        self.assertEqual(result["feedback"]["harmony"]["feedback"], "vom Modell")
+        self.assertEqual(result["feedback"]["rhythm"],
+                         main.generate_rule_based_feedback({}, {})["rhythm"])
+
+    def test_complete_stream_has_no_partial_marker(self):
+        async def fake(facts, tune, knowledge, on_section, should_abort=None):
+            return {c: section(c) for c in main.FEEDBACK_CATEGORIES}
+
+        result = self.run_feedback(fake)
+        self.assertTrue(result["ai_generated"])
+        self.assertNotIn("ai_partial", result)
+
+
+class LLMPhaseTest(unittest.TestCase):
+    """Die LLM-Phase belegt llm_jobs, nicht die Analyse-Worker."""
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.ids = []
+        entered = self.entered = threading.Semaphore(0)
+        release = self.release
+
+        async def slow_llm(facts, tune, knowledge, on_section, should_abort=None):
+            entered.release()
+            await asyncio.get_running_loop().run_in_executor(None, release.wait, 10)
+            return None
+
+        self.jobs = main.job_queue.JobQueue(workers=2)
+        self.llm_jobs = main.job_queue.JobQueue(workers=2)
+        for name, value in (("jobs", self.jobs), ("llm_jobs", self.llm_jobs),
+                            ("get_apertus_feedback_grounded", slow_llm),
+                            ("_prepare_jazz_result", lambda res: dict(AttachFeedbackTest.PREPARED)),
+                            ("apertus_enabled", True)):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.drain)
+
+    async def upload(self):
+        response = await main._analyze_inline(lambda: {"ok": True}, wait=3, llm=True)
+        body = json.loads(response.body)
+        self.ids.append(body["analysis_id"])
+        return body
+
+    @staticmethod
+    def wait_idle(queue):
+        for _ in range(100):
+            status = queue.status()
+            if not status["running"] and not sum(status["queued"].values()):
+                return
+            time.sleep(0.05)
+
+    def drain(self):
+        self.release.set()
+        self.wait_idle(self.llm_jobs)
+        for analysis_id in self.ids:
+            main.analysis_results.pop(analysis_id, None)
+
+    def test_wait_analysis_finishes_while_llm_slots_busy(self):
+        async def run():
+            for _ in range(4):                  # 2 im LLM, 2 warten auf llm_jobs
+                await self.upload()
+            for _ in range(2):
+                self.assertTrue(self.entered.acquire(timeout=5))
+            return await self.upload()
+
+        body = asyncio.run(run())
+        self.assertEqual(body["stage"], "ai")
+        self.assertTrue(body["result"]["ai_pending"])
+        self.wait_idle(self.jobs)
+        self.assertEqual(self.llm_jobs.status()["running"], 2)
+        self.assertEqual(self.llm_jobs.status()["queued"]["interactive"], 3)
+
+    def test_cancel_while_llm_phase_waits(self):
+        async def run():
+            for _ in range(3):
+                await self.upload()
+
+        asyncio.run(run())
+        self.assertTrue(self.entered.acquire(timeout=5))
+        self.assertTrue(self.entered.acquire(timeout=5))
+        self.wait_idle(self.jobs)              # eine LLM-Phase wartet in llm_jobs
+        analysis_id = self.llm_jobs.heap[0][4]
+        asyncio.run(main.delete_result(analysis_id))
+        self.assertNotIn(analysis_id, main.analysis_results)
+        self.assertNotIn(analysis_id, main._running)
+        self.assertNotIn(analysis_id, main._cancelled)
+        self.assertEqual(self.llm_jobs.status()["cancelled"], 1)
+
+
+class DedupIndexTest(unittest.TestCase):
+    def test_index_is_bounded(self):
+        self.addCleanup(main._dedup_index.clear)
+        main._dedup_index.clear()
+        ids = []
+        with mock.patch.object(main, "DEDUP_INDEX_SIZE", 3), \
+                mock.patch.object(main.jobs, "submit"):
+            for i in range(5):
+                analysis_id = str(uuid.uuid4())
+                ids.append(analysis_id)
+                self.addCleanup(main.analysis_results.pop, analysis_id, None)
+                main._enqueue(analysis_id, None, fingerprint=f"fp{i}")
+                if i == 2:
+                    self.assertEqual(main._dedup_lookup("fp0"), ids[0])   # frisch halten
+        self.assertEqual(list(main._dedup_index), ["fp0", "fp3", "fp4"])
+        self.assertIsNone(main._dedup_lookup("fp1"))
+        self.assertIn(ids[1], main.analysis_results)          # nur der Index verliert ihn
+
+
+class BatchResultsTest(unittest.TestCase):
+    def test_only_finished_batches_are_evicted(self):
+        saved = dict(main.batch_results)
+        main.batch_results.clear()
+
+        def restore():
+            main.batch_results.clear()
+            main.batch_results.update(saved)
+        self.addCleanup(restore)
+        with mock.patch.object(main, "BATCH_RESULTS_SIZE", 2):
+            main._store_batch("running", {"status": "processing"})
+            for i in range(3):
+                main._store_batch(f"done{i}", {"status": "completed"})
+        self.assertEqual(list(main.batch_results), ["running", "done2"])
+
+
+def zip_upload(entries):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in entries:
+            z.writestr(name, data)
+    buf.seek(0)
+    return UploadFile(file=buf, filename="klasse.zip")
+
+
+class BatchItemsTest(unittest.TestCase):
+    def batch_items(self, files):
+        return asyncio.run(main._batch_items(files))
+
+    def count_reads(self):
+        reads = []
+        real_read = zipfile.ZipFile.read
+
+        def read(zf, info, *args):
+            reads.append(info)
+            return real_read(zf, info, *args)
+        self.addCleanup(mock.patch.stopall)
+        mock.patch.object(zipfile.ZipFile, "read", read).start()
+        return reads
+
+    def test_file_limit_checked_before_reading(self):
+        reads = self.count_reads()
+        upload = zip_upload([(f"s{i}.mid", b"MThd") for i in range(10)])
+        with mock.patch.object(main, "BATCH_MAX_FILES", 3), \
+                self.assertRaises(HTTPException) as cm:
+            self.batch_items([upload])
+        self.assertEqual(cm.exception.status_code, 413)
+        self.assertEqual(len(reads), 3)
+
+    def test_uncompressed_total_checked_before_reading(self):
+        reads = self.count_reads()
+        # je 1 MB Nullen, gepackt nur ein paar KB
+        upload = zip_upload([(f"s{i}.mid", bytes(1024 * 1024)) for i in range(4)])
+        with mock.patch.object(main, "BATCH_MAX_BYTES", 2 * 1024 * 1024 + 1), \
+                self.assertRaises(HTTPException) as cm:
+            self.batch_items([upload])
+        self.assertEqual(cm.exception.status_code, 413)
+        self.assertEqual(len(reads), 2)
+
+    def test_plain_files_count_towards_total(self):
+        files = [UploadFile(file=io.BytesIO(bytes(600)), filename=f"s{i}.mid") for i in range(2)]
+        with mock.patch.object(main, "BATCH_MAX_BYTES", 1000), \
+                self.assertRaises(HTTPException):
+            self.batch_items(files)
+        files = [UploadFile(file=io.BytesIO(bytes(400)), filename=f"s{i}.mid") for i in range(2)]
+        with mock.patch.object(main, "BATCH_MAX_BYTES", 1000):
+            self.assertEqual([name for name, _ in self.batch_items(files)], ["s0.mid", "s1.mid"])
+
+
+if __name__ == "__main__":
+    unittest.main()
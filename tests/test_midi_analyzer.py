@@ -0,0 +1,131 @@
+import contextlib
+import io
+import random
+import struct
+import unittest
+
+import numpy as np
+
+import midi_analyzer
+
+
+def vlq(value):
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def midi_file(body, ticks_per_beat=480):
+    return (b"MThd" + struct.pack(">IHHH", 6, 0, 1, ticks_per_beat)
+            + b"MTrk" + struct.pack(">I", len(body)) + body)
+
+
+def piano_take(n_notes=300, seed=0):
+    """Running Status, Note-Off als Velocity 0, Pedal-CCs, ein Tempowechsel."""
+    rng = random.Random(seed)
+    events, tick = [], 0
+    for i in range(n_notes):
+        tick += rng.choice([60, 120])
+        pitch = rng.randint(40, 90)
+        events.append((tick, bytes([0x90, pitch, rng.randint(30, 110)])))
+        events.append((tick + 60, bytes([0x90, pitch, 0])))
+        events.append((tick, bytes([0xB0, 64, rng.randint(0, 127)])))
+        if i == n_notes // 2:
+            events.append((tick, b"\xff\x51\x03\x06\x1a\x80"))
+    events.sort(key=lambda e: e[0])
+    body, last, running = bytearray(b"\x00\xff\x51\x03\x07\xa1\x20"), 0, None
+    for t, msg in events:
+        body += vlq(t - last)
+        last = t
+        if msg[0] == running:
+            body += msg[1:]
+        else:
+            body += msg
+            running = msg[0] if msg[0] < 0xF0 else running
+    return midi_file(bytes(body + b"\x00\xff\x2f\x00"))
+
+
+def scan_both(data):
+    """(schneller Scan, exakter Scan) je Track, wie in parse_midi_events."""
+    mv = memoryview(data)
+    n = len(mv)
+    b = np.zeros(n + 8, dtype=np.uint8)
+    b[:n] = np.frombuffer(mv, dtype=np.uint8)
+    length, delta_len = midi_analyzer._event_lengths(b, n)
+    next_pos = np.arange(n, dtype=np.int32) + length
+    track_length, = struct.unpack_from(">I", mv, 18)
+    start, end = 22, min(22 + track_length, n)
+    return (midi_analyzer._scan_track_fast(b, next_pos, delta_len, start, end),
+            midi_analyzer._scan_track(mv, start, end))
+
+
+class ParserTest(unittest.TestCase):
+    def test_running_status_and_tempo_map(self):
+        notes = midi_analyzer.parse_midi_arrays(piano_take())
+        self.assertEqual(len(notes), 300)
+        self.assertEqual(notes.tempo_bpm, 120.0)
+        self.assertTrue(np.all(np.diff(notes.start) >= 0))
+
+    def test_overlong_varlen_is_format_error(self):
+        body = b"\x00\x90\x3c\x40" + b"\xff\xff\xff\xff\x7f" + b"\x80\x3c\x00"
+        with self.assertRaises(midi_analyzer.MidiFormatError):
+            midi_analyzer.parse_midi_arrays(midi_file(body))
+
+    def test_format_error_skips_mido_fallback(self):
+        body = b"\x00\x90\x3c\x40" + b"\xff\xff\xff\xff\x7f" + b"\x80\x3c\x00"
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            result = midi_analyzer.analyze_midi_file(midi_file(body))
+        self.assertEqual(result["total_notes"], 0)
+        self.assertIn("Variable-Length-Quantity", result["error"])
+
+    def test_zero_tempo_is_ignored(self):
+        body = b"\x00\xff\x51\x03\x00\x00\x00\x00\x90\x3c\x40\x83\x60\x80\x3c\x00"
+        notes = midi_analyzer.parse_midi_arrays(midi_file(body))
+        self.assertEqual(notes.tempo_bpm, 120.0)
+        self.assertAlmostEqual(float(notes.end[0]), 0.5)
+
+    def test_fast_scan_matches_exact_on_corrupt_input(self):
+        # Der schnelle Scan muss exakt gleich sein oder an _scan_track abgeben
+        clean = piano_take(200, seed=1)
+        rng = random.Random(3)
+        for _ in range(200):
+            data = bytearray(clean)
+            for _ in range(rng.randint(1, 12)):
+                data[rng.randrange(22, len(data))] = rng.randrange(256)
+            if rng.random() < 0.3:                 # ueberlange Laengenangabe
+                pos = rng.randrange(22, len(data))
+                data[pos:pos] = b"\xff" * rng.randint(4, 8)
+            data = bytes(data[:rng.randrange(len(data) // 2, len(data) + 1)])
+            try:
+                fast, exact = scan_both(data)
+            except midi_analyzer.MidiFormatError:
+                continue
+            if fast is None:
+                continue
+            for a, b in zip(fast[:3], exact[:3]):
+                np.testing.assert_array_equal(a, b)
+            self.assertEqual(fast[3], exact[3])
+
+
+class RankKeysTest(unittest.TestCase):
+    def test_full_ranking(self):
+        ranking = midi_analyzer.rank_keys([60, 64, 67, 72, 65, 62, 71])
+        self.assertEqual(len(ranking), 24)
+        self.assertEqual(ranking[0][0], "C Major")
+        scores = [score for _, score in ranking]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_flat_or_empty_keeps_shape(self):
+        for pitches in ([], list(range(60, 72))):
+            ranking = midi_analyzer.rank_keys(pitches)
+            self.assertEqual(len(ranking), 24)
+            self.assertEqual(ranking[0], ("C Major", 0.0))
+            self.assertEqual({score for _, score in ranking}, {0.0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -199,36 +199,76 @@ HTML_TEMPLATE = """
             return o;
         }
 
+        // Binaeres Note-Format JZN1 (siehe jazz_service.decode_note_columns):
+        // Header + float32 start/end + uint8 pitch/amplitude, gzip wenn verfuegbar.
+        async function encodeNotes(notes) {
+            const n = notes.length, buf = new ArrayBuffer(8 + 10 * n);
+            new Uint8Array(buf, 0, 4).set([74, 90, 78, 49]);   // "JZN1"
+            new DataView(buf).setUint32(4, n, true);
+            const start = new Float32Array(buf, 8, n), end = new Float32Array(buf, 8 + 4 * n, n);
+            const pitch = new Uint8Array(buf, 8 + 8 * n, n), amp = new Uint8Array(buf, 8 + 9 * n, n);
+            notes.forEach(([s, e, p, a], i) => {
+                start[i] = s; end[i] = e; pitch[i] = p; amp[i] = Math.round(Math.min(1, Math.max(0, a)) * 255);
+            });
+            if (!window.CompressionStream) return buf;
+            return await new Response(new Blob([buf]).stream().pipeThrough(new CompressionStream('gzip'))).arrayBuffer();
+        }
+
+        const SYNC_WAIT = 3;           // Sekunden fuer den synchronen Schnellpfad (?wait=)
+        let pendingFeedback = null;    // regelbasiertes Feedback aus der Sofort-Antwort
+        let activeJob = null;          // {id, stop} des laufenden Jobs
+
+        // Neuer Upload: alten Job serverseitig abbrechen (DELETE /result/{id}),
+        // damit kein CPU-/LLM-Budget fuer verworfene Analysen anfaellt
+        function cancelActiveJob() {
+            if (!activeJob) return;
+            activeJob.stop();
+            fetch('/result/' + activeJob.id, { method: 'DELETE' }).catch(() => {});
+            activeJob = null;
+        }
+
         document.getElementById('analyzeBtn').addEventListener('click', async () => {
             if (!selectedFile) return;
+            cancelActiveJob();
             document.getElementById('loading').classList.remove('hidden');
             document.getElementById('results').innerHTML = '';
             setProgress(8, 'Vorbereiten...');
             try {
-                let id;
+                let id, started;
+                pendingFeedback = null;
                 if (isAudio) {
                     setProgress(10, 'Transkribiere Audio im Browser (Basic Pitch)...');
                     const notes = await transcribeAudio(selectedFile, (p) =>
                         setProgress(10 + Math.round(p * 40), 'Transkribiere Audio... ' + Math.round(p * 100) + '%'));
                     if (!notes.length) throw new Error('Keine Noten erkannt — anderes/laengeres Audio probieren.');
                     setProgress(55, 'Sende ' + notes.length + ' Noten zur Analyse...');
-                    const body = Object.assign({ notes }, contextFields());
-                    const res = await fetch('/analyze-notes', {
-                        method: 'POST', headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify(body)
+                    const res = await fetch('/analyze-notes?' + new URLSearchParams(Object.assign({ wait: SYNC_WAIT }, contextFields())), {
+                        method: 'POST', headers: { 'Content-Type': 'application/x-jazz-notes' },
+                        body: await encodeNotes(notes)
                     });
                     if (!res.ok) throw new Error((await res.json().catch(() => ({}))).detail || 'Analyse-Upload fehlgeschlagen');
-                    id = (await res.json()).analysis_id;
+                    started = await res.json();
                 } else {
                     setProgress(15, 'Upload MIDI...');
                     const fd = new FormData();
                     fd.append('file', selectedFile);
                     const cf = contextFields();
                     Object.keys(cf).forEach(k => fd.append(k, cf[k]));
-                    const res = await fetch('/analyze-jazz', { method: 'POST', body: fd });
+                    const res = await fetch('/analyze-jazz?wait=' + SYNC_WAIT, { method: 'POST', body: fd });
                     if (!res.ok) throw new Error((await res.json().catch(() => ({}))).detail || 'Upload fehlgeschlagen');
-                    id = (await res.json()).analysis_id;
+                    started = await res.json();
+                }
+                // Schnellpfad: Report kommt direkt mit, nur das KI-Feedback folgt
+                if (started.status === 'error') throw new Error(started.error);
+                if (started.result) {
+                    pendingFeedback = started.result.feedback;
+                    render(started.result, started.analysis_id);
+                }
+                if (started.status === 'completed') {
+                    document.getElementById('loading').classList.add('hidden');
+                    return;
                 }
+                id = started.analysis_id;
                 setProgress(60, 'Analysiere...');
                 poll(id);
             } catch (e) {
@@ -238,25 +278,64 @@ HTML_TEMPLATE = """
             }
         });
 
+        // Fortschritt eines Jobs: bevorzugt per Server-Sent Events (fertige
+        // Feedback-Kategorien erscheinen sofort), sonst Polling alle 2s.
+        // Status-Updates nur mit den noetigen Feldern; das fertige Ergebnis ohne
+        // die grossen Arrays (Piano-Roll-Noten laedt drawPianoRoll selbst).
+        const STATUS_FIELDS = 'status,stage,error,partial_feedback';
+        const RESULT_FIELDS = 'result,-facts,-report.notes_view,-report.line.detail,-report.voicings.voicings';
+
+        async function loadResult(id) {
+            const data = await (await fetch('/result/' + id + '?fields=' + RESULT_FIELDS)).json();
+            setProgress(100);
+            setTimeout(() => { document.getElementById('loading').classList.add('hidden'); render(data.result, id); }, 300);
+        }
+
+        function handleUpdate(data, attempts, id) {
+            if (data.status === 'completed' || data.status === 'error')
+                if (activeJob && activeJob.id === id) activeJob = null;
+            if (data.status === 'completed') {
+                loadResult(id).catch(e => { console.error(e); alert('Fehler: ' + e.message); });
+                return true;
+            }
+            if (data.status === 'error') {
+                alert('Fehler: ' + data.error);
+                document.getElementById('loading').classList.add('hidden');
+                return true;
+            }
+            setProgress(60 + Math.min(35, attempts), data.stage === 'ai' ? 'Apertus AI Feedback...' : 'Noten & Theorie...');
+            const fc = document.getElementById('feedbackCards');
+            if (data.partial_feedback && fc)
+                fc.innerHTML = feedbackCards(Object.assign({}, pendingFeedback, data.partial_feedback));
+            else if (data.partial_feedback)
+                document.getElementById('results').innerHTML = '<p class="text-sm text-gray-500">Feedback kommt an...</p>' + feedbackCards(data.partial_feedback);
+            return false;
+        }
+
         function poll(id) {
+            if (window.EventSource) {
+                const es = new EventSource('/result/' + id + '/events?fields=' + STATUS_FIELDS);
+                let updates = 0, done = false;
+                activeJob = { id, stop: () => { done = true; es.close(); } };
+                es.onmessage = ev => { done = handleUpdate(JSON.parse(ev.data), ++updates, id) || done; if (done) es.close(); };
+                es.onerror = () => { es.close(); if (!done) pollInterval(id); };
+                return;
+            }
+            pollInterval(id);
+        }
+
+        function pollInterval(id) {
             const maxAttempts = 90;
             let attempts = 0;
             const iv = setInterval(async () => {
                 attempts++;
                 try {
-                    const data = await (await fetch('/result/' + id)).json();
-                    if (data.status === 'completed') {
-                        clearInterval(iv); setProgress(100);
-                        setTimeout(() => { document.getElementById('loading').classList.add('hidden'); render(data.result); }, 300);
-                    } else if (data.status === 'error') {
-                        clearInterval(iv); alert('Fehler: ' + data.error);
-                        document.getElementById('loading').classList.add('hidden');
-                    } else {
-                        setProgress(60 + Math.min(35, attempts), data.stage === 'ai' ? 'Apertus AI Feedback...' : 'Noten & Theorie...');
-                    }
-                    if (attempts >= maxAttempts) { clearInterval(iv); alert('Timeout'); document.getElementById('loading').classList.add('hidden'); }
+                    const data = await (await fetch('/result/' + id + '?fields=' + STATUS_FIELDS)).json();
+                    if (handleUpdate(data, attempts, id)) clearInterval(iv);
+                    else if (attempts >= maxAttempts) { clearInterval(iv); alert('Timeout'); document.getElementById('loading').classList.add('hidden'); }
                 } catch (e) { console.error('poll', e); }
             }, 2000);
+            activeJob = { id, stop: () => clearInterval(iv) };
         }
 
         // --- Rendering ------------------------------------------------------
@@ -273,10 +352,29 @@ HTML_TEMPLATE = """
                 + '<div class="' + colorClass + ' h-2 rounded-full" style="width:' + w + '%"></div></div></div>';
         }
 
-        function drawPianoRoll(report) {
+        // notes_view columnar-v1 (jazz_service.encode_notes_view) -> [{on, off, p, voice}]
+        function decodeNotesView(v) {
+            if (!v || Array.isArray(v)) return v || [];
+            const bits = Uint8Array.from(atob(v.comp || ''), c => c.charCodeAt(0));
+            const out = new Array(v.n);
+            let on = 0;
+            for (let i = 0; i < v.n; i++) {
+                on += v.d_on[i];
+                out[i] = { on: on / 1000, off: (on + v.dur[i]) / 1000, p: v.p[i],
+                           voice: (bits[i >> 3] >> (i & 7)) & 1 ? 'comp' : 'line' };
+            }
+            return out;
+        }
+
+        async function drawPianoRoll(report, id) {
             const cv = document.getElementById('pianoRoll');
             if (!cv) return;
-            const notes = report.notes_view || [];
+            let nv = report.notes_view;
+            if (!nv && id) {
+                const res = await fetch('/result/' + id + '/sections/notes_view?notes_view=columnar');
+                nv = res.ok ? await res.json() : null;
+            }
+            const notes = decodeNotesView(nv);
             if (!notes.length) return;
             const grid = report.grid || {};
             const bpm = grid.bpm || 120, spb = 60 / bpm;
@@ -338,7 +436,26 @@ HTML_TEMPLATE = """
             });
         }
 
-        function render(d) {
+        function feedbackCards(fb) {
+            fb = fb || {};
+            let html = '';
+            [['Rhythmus & Time-Feel', fb.rhythm], ['Harmonie', fb.harmony],
+             ['Melodie & Linienfuehrung', fb.melody], ['Artikulation & Dynamik', fb.articulation]
+            ].forEach(([title, cat]) => {
+                if (!cat) return;
+                const cc = scoreColor(cat.score);
+                html += '<div class="bg-white rounded-2xl shadow-lg p-6">'
+                    + '<div class="flex items-center justify-between mb-2"><h3 class="text-xl font-bold">' + title
+                    + '</h3><span class="text-2xl font-bold text-' + cc + '-600">' + Number(cat.score).toFixed(1) + '</span></div>'
+                    + '<p class="text-gray-700 mb-3">' + (cat.feedback || '') + '</p>'
+                    + '<div class="bg-gray-50 rounded-lg p-4"><p class="font-semibold mb-2 text-sm">Tipps:</p><ul class="space-y-1">'
+                    + (cat.tips || []).map(t => '<li class="text-sm text-gray-600">• ' + t + '</li>').join('')
+                    + '</ul></div></div>';
+            });
+            return html;
+        }
+
+        function render(d, id) {
             const r = d.report || {};
             const ctx = r.context || { kind: 'none', label: 'Ohne Harmonie-Kontext' };
             const line = r.line || {};
@@ -360,7 +477,9 @@ HTML_TEMPLATE = """
                 + '<div class="text-2xl font-bold">' + (ctx.label || d.tune || '—') + '</div>'
                 + '<div class="text-sm opacity-90 mt-1">' + (used.n_notes || 0) + ' Noten · '
                 + srcLabel + ' · ' + (used.bpm || '?') + ' BPM · ' + (used.beats_per_bar || 4) + '/4 · '
-                + (d.ai_generated ? 'Feedback: Apertus AI' : 'Feedback: regelbasiert') + '</div></div>';
+                + (d.ai_generated ? 'Feedback: Apertus AI'
+                   : d.ai_partial ? 'Feedback: Apertus AI (' + d.ai_partial.join(', ') + '), sonst regelbasiert'
+                   : 'Feedback: regelbasiert') + '</div></div>';
 
             // Piano-Roll (Erkennung pruefen)
             html += '<div class="bg-white border-2 border-gray-200 rounded-2xl p-5 shadow">'
@@ -433,23 +552,10 @@ HTML_TEMPLATE = """
                 html += '</ul></div>';
             }
 
-            const fb = d.feedback || {};
-            [['Rhythmus & Time-Feel', fb.rhythm], ['Harmonie', fb.harmony],
-             ['Melodie & Linienfuehrung', fb.melody], ['Artikulation & Dynamik', fb.articulation]
-            ].forEach(([title, cat]) => {
-                if (!cat) return;
-                const cc = scoreColor(cat.score);
-                html += '<div class="bg-white rounded-2xl shadow-lg p-6">'
-                    + '<div class="flex items-center justify-between mb-2"><h3 class="text-xl font-bold">' + title
-                    + '</h3><span class="text-2xl font-bold text-' + cc + '-600">' + cat.score.toFixed(1) + '</span></div>'
-                    + '<p class="text-gray-700 mb-3">' + (cat.feedback || '') + '</p>'
-                    + '<div class="bg-gray-50 rounded-lg p-4"><p class="font-semibold mb-2 text-sm">Tipps:</p><ul class="space-y-1">'
-                    + (cat.tips || []).map(t => '<li class="text-sm text-gray-600">• ' + t + '</li>').join('')
-                    + '</ul></div></div>';
-            });
+            html += '<div id="feedbackCards" class="space-y-6">' + feedbackCards(d.feedback) + '</div>';
 
             document.getElementById('results').innerHTML = html;
-            drawPianoRoll(r);
+            drawPianoRoll(r, id);
         }
     </script>
 </body>